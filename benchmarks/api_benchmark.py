@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+
+"""api_benchmark.py
+
+Offline benchmark suite of the ConferenceApi endpoint methods, run
+against the testbed datastore, memcache, taskqueue and search stubs on a
+synthetic dataset (see datagen.py).
+
+Every operation is called --iterations times after --warmup untimed
+calls, as a new request each time (the ndb context cache is cleared,
+memcache too with --cold). The per-operation ops/sec, p50/p99 latency
+and mean RPCs per call by service are printed and written as JSON to
+--output. With --baseline, the results are compared with an earlier
+run: an operation regresses when its p50 latency or its RPCs per call
+grow, or its ops/sec drop, by more than --threshold (a fraction), and
+the script then exits with status 1.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/api_benchmark.py --output after.json \\
+        --baseline before.json --threshold 0.2
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import datagen
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+AUTH_DOMAIN = 'example.com'
+COMPARED = (('p50_ms', 1), ('rpcs', 1), ('ops_per_sec', -1))
+
+_rpcs = {}
+
+
+def _countRpc(service, call, request, response):
+    _rpcs[service] = _rpcs.get(service, 0) + 1
+
+
+def _as(p_key):
+    """Make p_key the user signed in to the endpoints, nobody if None."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = p_key.id() if p_key else ''
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = AUTH_DOMAIN
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+# - - - Operations - - - - - - - - - - - - - - - - - - - - - -
+
+def operations(api, data):
+    """Return [(name, prepare)] for every benchmarked operation.
+
+    prepare(i) runs untimed before iteration i, setting up the user and
+    the datastore state the call expects, and returns the timed call.
+    """
+    import conference
+    import counters
+    from models import ConferenceForm
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+    from models import ConferenceSearchForm
+    from models import ProfileMiniForm
+    from models import Registration
+    from models import SessionForm
+    from models import SessionForms
+    from models import TeeShirtSize
+    from models import WebsafeKeysForm
+    from models import WishlistEntry
+    from models import WishlistModifyForm
+    from protorpc import message_types
+
+    wscks = [c_key.urlsafe() for c_key in data.conferences]
+    wssks = [s_key.urlsafe() for s_key in data.sessions]
+    organizer = data.conferences[0].parent()
+    owned = [wsck for c_key, wsck in zip(data.conferences, wscks)
+             if c_key.parent() == organizer]
+    attendees = sorted(data.registrations, key=lambda p_key:
+        -len(data.registrations[p_key]))
+    wishers = sorted(data.wishlists, key=lambda p_key:
+        -len(data.wishlists[p_key]))
+    # registrations go to the conference with the most free seats
+    roomy = max(ndb.get_multi(data.conferences),
+        key=lambda conf: conf.seatsAvailable).key
+    void = message_types.VoidMessage
+
+    def request(container, **kwargs):
+        return container.combined_message_class(**kwargs)
+
+    def query(*filters):
+        return ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field=field, operator=operator, value=value)
+            for field, operator, value in filters])
+
+    def anonymous(call):
+        def prepare(i):
+            _as(None)
+            return call(i)
+        return prepare
+
+    def signedIn(users, call):
+        def prepare(i):
+            _as(users[i % len(users)])
+            return call(i)
+        return prepare
+
+    def registration(reg):
+        def prepare(i):
+            p_key = data.profiles[i % len(data.profiles)]
+            _as(p_key)
+            r_key = ndb.Key(Registration, roomy.urlsafe(), parent=p_key)
+            # (un)register first so the timed call always changes state
+            if reg and r_key.get():
+                r_key.delete()
+                counters.releaseSeat(roomy)
+            elif not reg and not r_key.get():
+                counters.reserveSeat(roomy.get())
+                Registration(key=r_key).put()
+            req = request(conference.CONF_GET_REQUEST,
+                websafeConferenceKey=roomy.urlsafe())
+            if reg:
+                return lambda: api.registerForConference(req)
+            return lambda: api.unregisterFromConference(req)
+        return prepare
+
+    def wishlistEntry(add):
+        def prepare(i):
+            p_key = data.profiles[i % len(data.profiles)]
+            _as(p_key)
+            wssk = wssks[i % len(wssks)]
+            w_key = ndb.Key(WishlistEntry, wssk, parent=p_key)
+            if add:
+                w_key.delete()
+                req = request(conference.SESSION_WISHLIST_POST_REQUEST,
+                    websafeSessionKey=wssk)
+                return lambda: api.addSessionToWishlist(req)
+            WishlistEntry(key=w_key).put()
+            req = request(conference.SESSION_WISHLIST_DELETE_REQUEST,
+                websafeSessionKey=wssk)
+            return lambda: api.deleteSessionInWishlist(req)
+        return prepare
+
+    def modifyWishlist(i):
+        wssk = wssks[i % len(wssks)]
+        # alternately add and remove the same session
+        if i % 2:
+            req = WishlistModifyForm(remove=[wssk])
+        else:
+            req = WishlistModifyForm(add=[wssk])
+        return lambda: api.modifyWishlist(req)
+
+    def createConference(i):
+        req = ConferenceForm(name='Benchmark conference %d' % i,
+            description='Created by the benchmark', topics=['Cloud'],
+            city='London', startDate='2016-10-01', endDate='2016-10-02',
+            maxAttendees=100)
+        return lambda: api.createConference(req)
+
+    def updateConference(i):
+        req = request(conference.CONF_POST_REQUEST,
+            websafeConferenceKey=owned[i % len(owned)],
+            description='Updated by the benchmark %d' % i)
+        return lambda: api.updateConference(req)
+
+    def createSession(i):
+        req = SessionForm(name='Benchmark session %d' % i,
+            highlights='Benchmark', speaker=data.speakers[i % len(data.speakers)],
+            duration=60, typeOfSession='Lecture', date='2016-10-01',
+            startTime='10:00', websafeConferenceKey=owned[i % len(owned)])
+        return lambda: api.createSession(req)
+
+    def createSessions(i):
+        # a 20 session agenda
+        req = SessionForms(items=[SessionForm(name='Benchmark session %d.%d' % (i, n),
+            highlights='Benchmark', speaker=data.speakers[n % len(data.speakers)],
+            duration=60, typeOfSession='Lecture', date='2016-10-01',
+            startTime='%02d:00' % (8 + n % 10),
+            websafeConferenceKey=owned[i % len(owned)]) for n in range(20)])
+        return lambda: api.createSessions(req)
+
+    def saveProfile(i):
+        # the display name is kept, a change of it fans out a task
+        req = ProfileMiniForm(teeShirtSize=TeeShirtSize.M_M if i % 2
+                              else TeeShirtSize.L_W)
+        return lambda: api.saveProfile(req)
+
+    def call(method, make):
+        def prepare(i):
+            req = make(i)
+            return lambda: method(req)
+        return prepare
+
+    def notModified(method, make):
+        # polls with the etag of an untimed first read
+        def prepare(i):
+            req = make(i)
+            req.ifNoneMatch = method(req).etag
+            return lambda: method(req)
+        return prepare
+
+    top = wscks[:50]
+    return [
+        ('queryConferences', anonymous(call(api.queryConferences,
+            lambda i: query()))),
+        ('queryConferences.city', anonymous(call(api.queryConferences,
+            lambda i: query(('CITY', 'EQ', 'London'))))),
+        ('queryConferences.topicMonth', anonymous(call(api.queryConferences,
+            lambda i: query(('TOPIC', 'EQ', 'Web Technologies'),
+                            ('MONTH', 'EQ', str(4 + i % 7)))))),
+        ('queryConferences.maxAttendees', anonymous(call(api.queryConferences,
+            lambda i: query(('CITY', 'EQ', 'London'),
+                            ('MAX_ATTENDEES', 'GT', '100'))))),
+        ('queryConferences.multiInequality', anonymous(call(api.queryConferences,
+            lambda i: query(('MAX_ATTENDEES', 'GT', '100'),
+                            ('MONTH', 'GTEQ', str(3 + i % 7)))))),
+        ('queryConferenceSummaries', anonymous(call(
+            api.queryConferenceSummaries, lambda i: query()))),
+        ('queryConferenceSummaries.city', anonymous(call(
+            api.queryConferenceSummaries,
+            lambda i: query(('CITY', 'EQ', 'London'))))),
+        ('queryConferences.paged', anonymous(call(api.queryConferences,
+            lambda i: ConferenceQueryForms(pageSize=5 + i % 20)))),
+        ('searchConferences', anonymous(call(api.searchConferences,
+            lambda i: ConferenceSearchForm(query='conference about cloud')))),
+        ('searchConferences.sorted', anonymous(call(api.searchConferences,
+            lambda i: ConferenceSearchForm(sort='startDate', onlyAvailable=True)))),
+        ('getConference', anonymous(call(api.getConference,
+            lambda i: request(conference.CONF_GET_CONDITIONAL_REQUEST,
+                websafeConferenceKey=top[i % len(top)])))),
+        ('getConference.notModified', anonymous(notModified(api.getConference,
+            lambda i: request(conference.CONF_GET_CONDITIONAL_REQUEST,
+                websafeConferenceKey=top[i % len(top)])))),
+        ('getConferencesBatch', anonymous(call(api.getConferencesBatch,
+            lambda i: WebsafeKeysForm(websafeKeys=top)))),
+        ('getConferencesCreated', signedIn([organizer],
+            call(api.getConferencesCreated,
+            lambda i: request(conference.CONF_LIST_REQUEST)))),
+        ('createConference', signedIn([organizer], createConference)),
+        ('updateConference', signedIn([organizer], updateConference)),
+        ('getConferenceSessions', anonymous(call(api.getConferenceSessions,
+            lambda i: request(conference.SESSION_GET_REQUEST,
+                websafeConferenceKey=top[i % len(top)])))),
+        ('getConferenceSessions.notModified', anonymous(notModified(
+            api.getConferenceSessions,
+            lambda i: request(conference.SESSION_GET_REQUEST,
+                websafeConferenceKey=top[i % len(top)])))),
+        ('getSessionsBatch', anonymous(call(api.getSessionsBatch,
+            lambda i: WebsafeKeysForm(websafeKeys=wssks[:100])))),
+        ('getConferenceSessionsByType', anonymous(call(
+            api.getConferenceSessionsByType,
+            lambda i: request(conference.SESSION_GET_REQUEST_BY_TYPE,
+                websafeConferenceKey=top[i % len(top)],
+                typeOfSession='Lecture')))),
+        ('getSessionsBySpeaker', anonymous(call(api.getSessionsBySpeaker,
+            lambda i: request(conference.SESSION_GET_REQUEST_BY_SPEAKER,
+                speaker=data.speakers[i % min(20, len(data.speakers))])))),
+        ('getSpeakers', anonymous(call(api.getSpeakers,
+            lambda i: request(conference.CONF_LIST_REQUEST)))),
+        ('getSessionsByName', anonymous(call(api.getSessionsByName,
+            lambda i: request(conference.SESSION_GET_REQUEST_BY_NAME,
+                name='Session %d' % i)))),
+        ('getSessionsByHighlights', anonymous(call(api.getSessionsByHighlights,
+            lambda i: request(conference.SESSION_GET_REQUEST_BY_HIGHLIGHTS,
+                highlights='Session %d highlights' % i)))),
+        ('getSessionsByTypeAndStartTime', anonymous(call(
+            api.getConferenceSessionsByTypeAndStartTime,
+            lambda i: request(conference.SESSION_GET_REQUEST_BY_TYPE_AND_STARTTIME,
+                typeOfSession='Workshop', startTime='%02d:00' % (9 + i % 10))))),
+        ('getSessionsByTypeAndStartTime.conference', anonymous(call(
+            api.getConferenceSessionsByTypeAndStartTime,
+            lambda i: request(conference.SESSION_GET_REQUEST_BY_TYPE_AND_STARTTIME,
+                typeOfSession='Workshop', startTime='%02d:00' % (9 + i % 10),
+                websafeConferenceKey=top[i % len(top)])))),
+        ('createSession', signedIn([organizer], createSession)),
+        ('createSessions', signedIn([organizer], createSessions)),
+        ('getFeaturedSpeaker', anonymous(call(api.getFeaturedSpeaker,
+            lambda i: request(conference.FEATURED_SPEAKER_GET_REQUEST,
+                websafeConferenceKey=top[i % len(top)])))),
+        ('getAnnouncement', anonymous(call(api.getAnnouncement,
+            lambda i: void()))),
+        ('getProfile', signedIn(data.profiles, call(api.getProfile,
+            lambda i: void()))),
+        ('saveProfile', signedIn(data.profiles, saveProfile)),
+        ('registerForConference', registration(True)),
+        ('unregisterFromConference', registration(False)),
+        ('getConferencesToAttend', signedIn(attendees[:50] or data.profiles,
+            call(api.getConferencesToAttend, lambda i: void()))),
+        ('addSessionToWishlist', wishlistEntry(True)),
+        ('deleteSessionInWishlist', wishlistEntry(False)),
+        ('getSessionsInWishlist', signedIn(wishers[:50] or data.profiles,
+            call(api.getSessionsInWishlist, lambda i: void()))),
+        ('modifyWishlist', signedIn(data.profiles[:1], modifyWishlist)),
+    ]
+
+
+# - - - Runner - - - - - - - - - - - - - - - - - - - - - - - -
+
+def run(prepare, iterations, warmup, cold):
+    """Time iterations calls of one operation; returns its results."""
+    latencies = []
+    rpcs = {}
+    for i in range(-warmup, iterations):
+        # every call is a new request
+        ndb.get_context().clear_cache()
+        if cold:
+            memcache.flush_all()
+        func = prepare(i)
+        _rpcs.clear()
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        if i < 0:
+            continue
+        latencies.append(elapsed)
+        for service, count in _rpcs.items():
+            rpcs[service] = rpcs.get(service, 0) + count
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / sum(latencies),
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'rpcs': sum(rpcs.values()) / float(iterations),
+        'rpcs_by_service': dict((service, count / float(iterations))
+                                for service, count in rpcs.items()),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every operation against baseline; returns
+    the names of the operations that regressed beyond threshold."""
+    regressions = []
+    print
+    print 'Compared with baseline (threshold %d%%)' % (threshold * 100)
+    for name in sorted(results):
+        old = baseline.get(name)
+        if not old:
+            print '  %-44s new' % name
+            continue
+        changes = []
+        regressed = False
+        for metric, direction in COMPARED:
+            if not old[metric]:
+                continue
+            change = (results[name][metric] - old[metric]) / float(old[metric])
+            changes.append('%s %+.1f%%' % (metric, change * 100))
+            regressed = regressed or change * direction > threshold
+        if regressed:
+            regressions.append(name)
+        print '  %-44s %s%s' % (name, ', '.join(changes),
+                                '  REGRESSION' if regressed else '')
+    return regressions
+
+
+def main(args):
+    from conference import ConferenceApi
+    import instrumentation
+
+    # keep the stats flushes of the instrumented methods out of the counts
+    instrumentation.FLUSH_INTERVAL = float('inf')
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'benchmark', _countRpc)
+
+    print 'Generating dataset...'
+    start = time.time()
+    data = datagen.generate(profiles=args.profiles,
+        conferences=args.conferences, sessions=args.sessions,
+        registrations=args.registrations, wishlists=args.wishlists,
+        seed=args.seed)
+    summary = data.summary()
+    print '  %s (%.1f s)' % (', '.join('%d %s' % (count, kind)
+        for kind, count in sorted(summary.items())), time.time() - start)
+
+    random.seed(args.seed)
+    api = ConferenceApi()
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    print
+    print '%-44s %10s %9s %9s %7s' % ('operation', 'ops/sec', 'p50 ms',
+                                       'p99 ms', 'rpcs')
+    for name, prepare in operations(api, data):
+        if only and name not in only and name.split('.')[0] not in only:
+            continue
+        result = results[name] = run(prepare, args.iterations, args.warmup,
+                                     args.cold)
+        print '%-44s %10.1f %9.2f %9.2f %7.1f' % (name, result['ops_per_sec'],
+            result['p50_ms'], result['p99_ms'], result['rpcs'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                         'python': platform.python_version(),
+                         'dataset': summary,
+                         'iterations': args.iterations,
+                         'warmup': args.warmup,
+                         'cold': args.cold,
+                         'seed': args.seed},
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print
+        print 'Results written to %s' % args.output
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta']['dataset'] != summary:
+            print 'Warning: the baseline was run on a different dataset'
+        if compare(results, baseline['results'], args.threshold):
+            return 1
+    return 0
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', type=int, default=1000)
+    parser.add_argument('--conferences', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--registrations', type=int, default=5000)
+    parser.add_argument('--wishlists', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--cold', action='store_true',
+        help='flush memcache before every call')
+    parser.add_argument('--only',
+        help='comma separated operations (or method names) to run')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--baseline',
+        help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='relative change counted as a regression (default 0.2)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parseArgs()
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_search_stub()
+    tb.init_user_stub()
+    try:
+        status = main(args)
+    finally:
+        tb.deactivate()
+    sys.exit(status)
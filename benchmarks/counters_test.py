@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""counters_test.py
+
+Conference Organization seat counter tests, run against the testbed
+datastore and memcache stubs: concurrent registrations never oversell
+the seats of a conference, a retried adjust_seats task moves the seats
+once, and conferences stored before seat sharding keep their seats.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/counters_test.py
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import counters
+from models import Conference
+
+SEATS = 30
+THREADS = 10
+ATTEMPTS = 6  # per thread: twice as many registrations as seats
+
+
+class CountersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(consistency_policy=
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+        self.conf = Conference(name='Seats', maxAttendees=SEATS,
+                               seatsAvailable=SEATS)
+        self.conf.put()
+        counters.createSeatShards(self.conf.key, SEATS)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def shardSeats(self):
+        return [shard.seats for shard in
+                ndb.get_multi(counters._shardKeys(self.conf.key)) if shard]
+
+    def seatsAvailable(self):
+        memcache.flush_all()
+        return counters.getSeatsAvailable(self.conf)
+
+    def testConcurrentReservationsNeverOversell(self):
+        reserved = []
+        failed = []
+
+        def register():
+            for _ in range(ATTEMPTS):
+                try:
+                    if counters.reserveSeat(self.conf):
+                        reserved.append(1)
+                except datastore_errors.TransactionFailedError:
+                    # too much contention: the registration is refused
+                    failed.append(1)
+
+        threads = [threading.Thread(target=register) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        seats = self.shardSeats()
+        self.assertTrue(all(s >= 0 for s in seats), seats)
+        self.assertTrue(len(reserved) <= SEATS)
+        self.assertEqual(SEATS - len(reserved), sum(seats))
+        if not failed:
+            self.assertEqual(SEATS, len(reserved))
+
+    def testSoldOut(self):
+        for _ in range(SEATS):
+            self.assertTrue(counters.reserveSeat(self.conf))
+        self.assertFalse(counters.reserveSeat(self.conf))
+        self.assertEqual(0, self.seatsAvailable())
+
+    def testRetriedAddIsAppliedOnce(self):
+        counters.adjustSeats(self.conf.key, 10, 'task-1')
+        counters.adjustSeats(self.conf.key, 10, 'task-1')
+        self.assertEqual(SEATS + 10, self.seatsAvailable())
+        counters.adjustSeats(self.conf.key, 10, 'task-2')
+        self.assertEqual(SEATS + 20, self.seatsAvailable())
+
+    def testRetriedRemoveIsAppliedOnce(self):
+        counters.adjustSeats(self.conf.key, -12, 'task-1')
+        counters.adjustSeats(self.conf.key, -12, 'task-1')
+        self.assertEqual(SEATS - 12, self.seatsAvailable())
+
+    def testInterruptedRemoveIsCompletedByRetry(self):
+        # the first attempt only got to take 2 seats off one shard
+        shard_key = counters._shardKeys(self.conf.key)[0]
+        counters._takeSeats(shard_key, 2, 'task-1')
+        counters.adjustSeats(self.conf.key, -12, 'task-1')
+        self.assertEqual(SEATS - 12, self.seatsAvailable())
+
+    def testRemoveNeverTakesTakenSeats(self):
+        for _ in range(SEATS - 5):
+            counters.reserveSeat(self.conf)
+        counters.adjustSeats(self.conf.key, -12, 'task-1')
+        self.assertEqual(0, self.seatsAvailable())
+        self.assertTrue(all(s >= 0 for s in self.shardSeats()))
+
+    def legacyConference(self, seats):
+        """Store a Conference the way it was before seat sharding."""
+        conf = Conference(name='Legacy', maxAttendees=seats,
+                          seatsAvailable=seats)
+        conf.put()
+        return conf
+
+    def testReleaseSeedsLegacyShards(self):
+        conf = self.legacyConference(SEATS)
+        counters.releaseSeat(conf.key)
+        memcache.flush_all()
+        self.assertEqual(SEATS + 1, counters.getSeatsAvailable(conf))
+
+    def testAdjustSeedsLegacyShardsOnce(self):
+        # updateConference already counted delta in seatsAvailable
+        conf = self.legacyConference(SEATS + 10)
+        counters.adjustSeats(conf.key, 10, 'task-1')
+        counters.adjustSeats(conf.key, 10, 'task-1')
+        memcache.flush_all()
+        self.assertEqual(SEATS + 10, counters.getSeatsAvailable(conf))
+
+    def testBackfillSeedsLegacyShards(self):
+        conf = self.legacyConference(SEATS)
+        self.assertEqual(None, counters.backfillSeatShards())
+        memcache.flush_all()
+        self.assertEqual(SEATS, counters.getSeatsAvailableAsync(
+            conf.key).get_result())
+        # conferences with shards keep them
+        self.assertEqual(SEATS, self.seatsAvailable())
+
+
+if __name__ == '__main__':
+    unittest.main()
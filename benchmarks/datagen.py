@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""datagen.py
+
+Synthetic Conference Organization dataset for the offline benchmarks.
+
+generate() stores Profiles, Conferences (with their seat shards),
+Sessions, Registrations and WishlistEntries with skewed, realistic
+distributions: a few big cities and popular topics, conference
+popularity and speaker activity following a Zipf-like law, lectures
+outnumbering panels, and wishlists drawn from the sessions of the
+conferences the user attends. The same seed always yields the same
+dataset. Needs an active testbed with the datastore, memcache and search
+stubs.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import bisect
+import random
+from datetime import date
+from datetime import time as dtime
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+PUT_BATCH_SIZE = 500
+
+CITIES = [('London', 20), ('San Francisco', 18), ('New York', 16),
+          ('Berlin', 10), ('Paris', 8), ('Tokyo', 8), ('Chicago', 6),
+          ('Amsterdam', 5), ('Bangalore', 5), ('Sydney', 4)]
+TOPICS = [('Web Technologies', 25), ('Programming Languages', 20),
+          ('Medical Innovations', 8), ('Movie Making', 5), ('Health and Nutrition', 7),
+          ('Cloud', 20), ('Machine Learning', 15)]
+# conference season peaks in spring and autumn
+MONTHS = [(1, 2), (2, 4), (3, 8), (4, 10), (5, 10), (6, 8), (7, 3),
+          (8, 2), (9, 9), (10, 11), (11, 8), (12, 2)]
+MAX_ATTENDEES = [(50, 25), (100, 30), (250, 20), (500, 15), (1000, 7),
+                 (5000, 3)]
+SESSION_TYPES = [('LECTURE', 40), ('WORKSHOP', 15), ('KEYNOTE', 5),
+                 ('PANEL', 10), ('WORKING_SESSION', 8), ('DEMO', 10),
+                 ('NOT_SPECIFIED', 7), ('OTHER', 5)]
+TEE_SHIRT_SIZES = ['NOT_SPECIFIED', 'S_M', 'S_W', 'M_M', 'M_W', 'L_M',
+                   'L_W', 'XL_M']
+ORGANIZER_RATIO = 0.1
+SPEAKER_RATIO = 0.2
+
+
+class Dataset(object):
+    """Keys of the generated entities, used to build benchmark requests."""
+
+    def __init__(self):
+        self.profiles = []      # Profile keys
+        self.organizers = []    # Profile keys Conferences are drawn for
+        self.conferences = []   # Conference keys, most popular first
+        self.sessions = []      # Session keys
+        self.speakers = []      # speaker names, most active first
+        self.registrations = {} # Profile key -> [Conference key]
+        self.wishlists = {}     # Profile key -> [Session key]
+
+    def summary(self):
+        return {'profiles': len(self.profiles),
+                'organizers': len(self.organizers),
+                'conferences': len(self.conferences),
+                'sessions': len(self.sessions),
+                'speakers': len(self.speakers),
+                'registrations': sum(len(v) for v in self.registrations.values()),
+                'wishlists': sum(len(v) for v in self.wishlists.values())}
+
+
+class _Weighted(object):
+    """Draws from a list of (value, weight) pairs."""
+
+    def __init__(self, rng, pairs):
+        self.rng = rng
+        self.values = [value for value, _ in pairs]
+        self.totals = []
+        total = 0
+        for _, weight in pairs:
+            total += weight
+            self.totals.append(total)
+
+    def __call__(self):
+        return self.values[bisect.bisect_right(
+            self.totals, self.rng.random() * self.totals[-1])]
+
+
+def _zipf(rng, values, exponent=1.1):
+    """A _Weighted draw where the n-th value has weight 1/n^exponent."""
+    return _Weighted(rng, [(value, 1.0 / (rank + 1) ** exponent)
+                           for rank, value in enumerate(values)])
+
+
+class _Writer(object):
+    """Buffers entities and stores them with put_multi in batches."""
+
+    def __init__(self):
+        self.batch = []
+
+    def put(self, entity):
+        self.batch.append(entity)
+        if len(self.batch) >= PUT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            ndb.put_multi(self.batch, use_cache=False, use_memcache=False)
+            self.batch = []
+
+
+def generate(profiles=1000, conferences=100, sessions=2000,
+             registrations=5000, wishlists=3000, seed=42):
+    """Store a synthetic dataset and return its Dataset.
+
+    Registrations never exceed a conference maxAttendees, so fewer may be
+    stored than asked for when the conferences are small.
+    """
+    from models import Conference
+    from models import Profile
+    from models import Registration
+    from models import Session
+    from models import WishlistEntry
+    from conference import ConferenceApi
+    import counters
+    import searchindex
+
+    rng = random.Random(seed)
+    data = Dataset()
+    writer = _Writer()
+
+    # Profiles, the first ORGANIZER_RATIO of them organize conferences
+    for i in range(profiles):
+        email = 'user%d@example.com' % i
+        data.profiles.append(ndb.Key(Profile, email))
+        writer.put(Profile(key=data.profiles[-1], displayName='User %d' % i,
+            mainEmail=email, teeShirtSize=rng.choice(TEE_SHIRT_SIZES)))
+    writer.flush()
+    data.organizers = data.profiles[:max(1, int(profiles * ORGANIZER_RATIO))]
+
+    # Conferences, a few prolific organizers own most of them
+    city = _Weighted(rng, CITIES)
+    topic = _Weighted(rng, TOPICS)
+    month = _Weighted(rng, MONTHS)
+    max_attendees = _Weighted(rng, MAX_ATTENDEES)
+    organizer = _zipf(rng, range(len(data.organizers)))
+    first = Conference.allocate_ids(size=conferences)[0] if conferences else 0
+    confs = []
+    for i in range(conferences):
+        p_index = organizer()
+        p_key = data.organizers[p_index]
+        start = date(2016, month(), rng.randint(1, 28))
+        confs.append(Conference(key=ndb.Key(Conference, first + i, parent=p_key),
+            name='Conference %d' % i,
+            description='A conference about %s' % topic().lower(),
+            organizerUserId=p_key.id(),
+            organizerDisplayName='User %d' % p_index,
+            topics=sorted(set(topic() for _ in range(rng.randint(1, 3)))),
+            city=city(), startDate=start, month=start.month,
+            endDate=start + timedelta(days=rng.randint(0, 3)),
+            maxAttendees=max_attendees()))
+    # the most popular conferences come first
+    data.conferences = [conf.key for conf in confs]
+
+    # Registrations, conference popularity is Zipf-like
+    popular = _zipf(rng, confs)
+    taken = dict((conf.key, 0) for conf in confs)
+    pairs = set()
+    for _ in range(registrations if confs else 0):
+        conf = popular()
+        p_key = rng.choice(data.profiles)
+        if taken[conf.key] >= conf.maxAttendees or (p_key, conf.key) in pairs:
+            continue
+        pairs.add((p_key, conf.key))
+        taken[conf.key] += 1
+        data.registrations.setdefault(p_key, []).append(conf.key)
+        writer.put(Registration(id=conf.key.urlsafe(), parent=p_key))
+    for conf in confs:
+        conf.seatsAvailable = conf.maxAttendees - taken[conf.key]
+        writer.put(conf)
+    writer.flush()
+    for conf in confs:
+        counters.createSeatShards(conf.key, conf.seatsAvailable)
+    searchindex.indexConferences(confs)
+
+    # Sessions, popular conferences have longer programs and a few
+    # speakers give most of the talks
+    data.speakers = ['Speaker %d' % i
+                     for i in range(max(1, int(sessions * SPEAKER_RATIO)))]
+    speaker = _zipf(rng, data.speakers)
+    session_type = _Weighted(rng, SESSION_TYPES)
+    program = _zipf(rng, confs, exponent=0.6)
+    by_conference = {}
+    for i in range(sessions if confs else 0):
+        conf = program()
+        by_conference.setdefault(conf.key, []).append(i)
+    stored = []
+    for conf in confs:
+        indexes = by_conference.get(conf.key, [])
+        if not indexes:
+            continue
+        first = Session.allocate_ids(size=len(indexes), parent=conf.key)[0]
+        for offset, i in enumerate(indexes):
+            s_key = ndb.Key(Session, first + offset, parent=conf.key)
+            data.sessions.append(s_key)
+            stored.append(Session(key=s_key, name='Session %d' % i,
+                highlights='Session %d highlights' % i,
+                speaker=speaker(), duration=rng.choice([30, 45, 60, 90]),
+                typeOfSession=session_type(),
+                date=conf.startDate + timedelta(
+                    days=rng.randint(0, (conf.endDate - conf.startDate).days)),
+                startTime=dtime(rng.randint(8, 18), rng.choice([0, 15, 30, 45])),
+                websafeConferenceKey=conf.key.urlsafe()))
+            writer.put(stored[-1])
+    writer.flush()
+
+    # WishlistEntries, mostly sessions of the conferences attended
+    sessions_of = {}
+    for s_key in data.sessions:
+        sessions_of.setdefault(s_key.parent(), []).append(s_key)
+    for _ in range(wishlists if data.sessions else 0):
+        p_key = rng.choice(data.profiles)
+        attended = [c_key for c_key in data.registrations.get(p_key, [])
+                    if c_key in sessions_of]
+        if attended and rng.random() < 0.8:
+            s_key = rng.choice(sessions_of[rng.choice(attended)])
+        else:
+            s_key = rng.choice(data.sessions)
+        wished = data.wishlists.setdefault(p_key, [])
+        if s_key not in wished:
+            wished.append(s_key)
+            writer.put(WishlistEntry(id=s_key.urlsafe(), parent=p_key))
+    writer.flush()
+
+    # speaker index and featured speaker statistics, as the tasks would
+    cursor = ConferenceApi._backfillSpeakers()
+    while cursor:
+        cursor = ConferenceApi._backfillSpeakers(cursor)
+    counts = {}
+    for session in stored:
+        ConferenceApi._addSessionsToSpeakerStats([session])
+        counts[session.speaker] = counts.get(session.speaker, 0) + 1
+
+    # speakers most active first
+    data.speakers = sorted(counts, key=lambda name: (-counts[name], name))
+    return data
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""mappers_benchmark.py
+
+Micro-benchmark of entity -> message conversion: the former reflective
+_copy*ToForm loops against the precompiled mappers in mappers.py.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/mappers_benchmark.py [number_of_entities]
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import os
+import sys
+import timeit
+from datetime import date
+from datetime import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+DEFAULT_ENTITIES = 10000
+
+
+def legacyConferenceToForm(conf):
+    """The reflective copy loop formerly in ConferenceApi."""
+    from models import ConferenceForm
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def legacySessionToForm(session):
+    """The reflective copy loop formerly in ConferenceApi."""
+    from models import SessionForm
+    session_form = SessionForm()
+    for field in session_form.all_fields():
+        if field.name == 'startTime':
+            session_form.startTime = str(session.startTime)
+        elif field.name == 'date':
+            session_form.date = str(session.date)
+        elif hasattr(session, field.name):
+            setattr(session_form, field.name, getattr(session, field.name))
+        elif field.name == "sessionSafeKey":
+            setattr(session_form, field.name, session.key.urlsafe())
+    session_form.check_initialized()
+    return session_form
+
+
+def legacyProfileToForm(prof):
+    """The reflective copy loop formerly in ConferenceApi."""
+    from models import ProfileForm
+    from models import TeeShirtSize
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def makeEntities(count):
+    """Build unsaved Conference, Session and Profile entities."""
+    from models import Conference
+    from models import Profile
+    from models import Session
+    profiles, conferences, sessions = [], [], []
+    for i in range(count):
+        p_key = ndb.Key(Profile, 'user%d@example.com' % i)
+        c_key = ndb.Key(Conference, i + 1, parent=p_key)
+        profiles.append(Profile(key=p_key, displayName='User %d' % i,
+            mainEmail='user%d@example.com' % i, teeShirtSize='M_M',
+            conferenceKeysToAttend=[c_key.urlsafe()]))
+        conferences.append(Conference(key=c_key, name='Conference %d' % i,
+            description='A conference about things', organizerUserId=p_key.id(),
+            topics=['Python', 'Web'], city='London',
+            startDate=date(2016, 6, 1), month=6, endDate=date(2016, 6, 3),
+            maxAttendees=100, seatsAvailable=42,
+            organizerDisplayName='User %d' % i))
+        sessions.append(Session(key=ndb.Key(Session, i + 1, parent=c_key),
+            name='Session %d' % i, highlights='Intro', speaker='Speaker %d' % (i % 50),
+            duration=60, typeOfSession='Workshop', date=date(2016, 6, 1),
+            startTime=time(10, 30), websafeConferenceKey=c_key.urlsafe()))
+    return conferences, sessions, profiles
+
+
+def bench(label, func, entities):
+    """Time func over entities and print the per-entity cost."""
+    seconds = min(timeit.repeat(lambda: [func(e) for e in entities],
+                                number=1, repeat=3))
+    print '%-28s %8.2f us/entity' % (label, seconds / len(entities) * 1e6)
+    return seconds
+
+
+def main(count):
+    import mappers
+
+    conferences, sessions, profiles = makeEntities(count)
+    cases = [
+        ('Conference', legacyConferenceToForm, mappers.conferenceToForm, conferences),
+        ('Session', legacySessionToForm, mappers.sessionToForm, sessions),
+        ('Profile', legacyProfileToForm, mappers.profileToForm, profiles),
+    ]
+    print 'Converting %d entities of each kind' % count
+    for kind, legacy, compiled, entities in cases:
+        # both implementations must produce the same message
+        assert legacy(entities[0]) == compiled(entities[0]), kind
+        old = bench('%s (reflective)' % kind, legacy, entities)
+        new = bench('%s (precompiled)' % kind, compiled, entities)
+        print '%-28s %8.2fx' % ('%s speedup' % kind, old / new)
+
+
+if __name__ == '__main__':
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    try:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ENTITIES)
+    finally:
+        tb.deactivate()
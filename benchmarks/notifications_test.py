@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""notifications_test.py
+
+Conference Organization confirmation email tests, run against the
+testbed datastore, memcache, taskqueue and mail stubs: notifications are
+leased in batches, a failed email is leased again after a backoff, and
+one failing MAX_ATTEMPTS times is moved to the dead letter queue.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/notifications_test.py
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import collections
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import notifications
+from models import Conference
+from models import Profile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BATCH_SIZE = 3
+
+# what _backoff reads of a leased task
+LeasedTask = collections.namedtuple('LeasedTask', 'retry_count')
+
+
+def _failingSendMail(*args, **kwargs):
+    raise RuntimeError('mail service unavailable')
+
+
+class NotificationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(consistency_policy=
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        ndb.get_context().clear_cache()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        self.saved = (notifications.BATCH_SIZE, notifications.mail.send_mail,
+                      notifications._backoff)
+        notifications.BATCH_SIZE = BATCH_SIZE
+
+    def tearDown(self):
+        (notifications.BATCH_SIZE, notifications.mail.send_mail,
+         notifications._backoff) = self.saved
+        self.testbed.deactivate()
+
+    def addConferences(self, count):
+        """Store count conferences of their own organizers and queue
+        their confirmation emails."""
+        for index in range(count):
+            p_key = ndb.Key(Profile, 'organizer%d@example.com' % index)
+            Profile(key=p_key, displayName='Organizer %d' % index,
+                    mainEmail=p_key.id()).put()
+            c_key = Conference(parent=p_key, name='Conference %d' % index,
+                               topics=['Python']).put()
+            notifications.enqueueConfirmationAsync(c_key).get_result()
+
+    def pullTasks(self, queue_name):
+        return self.taskqueue.GetTasks(queue_name)
+
+    def testBatchesAreLeased(self):
+        self.addConferences(BATCH_SIZE + 2)
+        counts = notifications.sendBatch()
+        self.assertEqual(BATCH_SIZE, counts['leased'])
+        self.assertEqual(BATCH_SIZE, counts['sent'])
+        # the rest is left for the next batch
+        self.assertEqual(2, len(self.pullTasks(notifications.EMAIL_QUEUE)))
+
+        counts = notifications.sendBatch()
+        self.assertEqual(2, counts['leased'])
+        self.assertEqual(2, counts['sent'])
+        self.assertEqual([], self.pullTasks(notifications.EMAIL_QUEUE))
+        self.assertEqual(0, notifications.sendBatch()['leased'])
+
+        sent = self.mail.get_sent_messages()
+        self.assertEqual(BATCH_SIZE + 2, len(sent))
+        self.assertEqual(notifications.SUBJECT, sent[0].subject)
+        self.assertTrue(sent[0].to.startswith('organizer'))
+
+    def testWorkerDrainsQueue(self):
+        self.addConferences(2 * BATCH_SIZE + 1)
+        totals = notifications.sendConfirmationEmails()
+        self.assertEqual(2 * BATCH_SIZE + 1, totals['sent'])
+        self.assertEqual([], self.pullTasks(notifications.EMAIL_QUEUE))
+
+    def testFailedEmailIsRetriedAfterBackoff(self):
+        self.addConferences(1)
+        notifications.mail.send_mail = _failingSendMail
+        before = time.time()
+        counts = notifications.sendBatch()
+        self.assertEqual(1, counts['leased'])
+        self.assertEqual(0, counts['sent'])
+        self.assertEqual(1, counts['retried'])
+
+        # kept in the queue, out of reach until the backoff has passed
+        tasks = self.pullTasks(notifications.EMAIL_QUEUE)
+        self.assertEqual(1, len(tasks))
+        backoff = tasks[0]['eta_usec'] / 1e6 - before
+        self.assertTrue(notifications.MIN_BACKOFF - 1 <= backoff <=
+                        notifications.MIN_BACKOFF * 2 + 1, backoff)
+        self.assertEqual(0, notifications.sendBatch()['leased'])
+
+    def testBackoffGrowsUpToMaximum(self):
+        backoffs = [notifications._backoff(LeasedTask(retry_count))
+                    for retry_count in range(12)]
+        self.assertEqual(notifications.MIN_BACKOFF, backoffs[0])
+        self.assertEqual(sorted(backoffs), backoffs)
+        self.assertEqual(notifications.MAX_BACKOFF, backoffs[-1])
+
+    def testDeadLetterAfterMaxAttempts(self):
+        self.addConferences(1)
+        notifications.mail.send_mail = _failingSendMail
+        # lease failed notifications again right away
+        notifications._backoff = lambda task: 0
+        retried = 0
+        for _ in range(notifications.MAX_ATTEMPTS + 1):
+            counts = notifications.sendBatch()
+            retried += counts['retried']
+            if counts['dead']:
+                break
+        self.assertEqual(1, counts['dead'])
+        self.assertTrue(0 < retried <= notifications.MAX_ATTEMPTS, retried)
+        self.assertEqual([], self.pullTasks(notifications.EMAIL_QUEUE))
+        self.assertEqual(1, len(self.pullTasks(notifications.DEAD_LETTER_QUEUE)))
+        self.assertEqual([], self.mail.get_sent_messages())
+
+        # moved back, the notification gets a new series of attempts
+        notifications.mail.send_mail = self.saved[1]
+        self.assertEqual(1, notifications.requeueDeadLetters())
+        self.assertEqual(1, notifications.sendBatch()['sent'])
+        self.assertEqual([], self.pullTasks(notifications.DEAD_LETTER_QUEUE))
+
+
+if __name__ == '__main__':
+    unittest.main()
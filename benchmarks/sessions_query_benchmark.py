@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""sessions_query_benchmark.py
+
+Benchmark of getConferenceSessionsByTypeAndStartTime: the former "!="
+query filtered in Python against the per-type projection query plan of
+ConferenceApi._sessionsBeforeTime, on a synthetic dataset.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/sessions_query_benchmark.py [number_of_sessions]
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from datetime import time as dtime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+DEFAULT_SESSIONS = 100000
+CONFERENCES = 200
+PUT_BATCH_SIZE = 500
+REPEAT = 3
+
+
+def seed(count):
+    """Store count Sessions spread over CONFERENCES conferences, with
+    random types and start times between 08:00 and 19:45."""
+    from models import Conference
+    from models import Profile
+    from models import Session
+    from models import SessionType
+
+    types = [str(session_type) for session_type in SessionType]
+    p_key = ndb.Key(Profile, 'organizer@example.com')
+    c_keys = [ndb.Key(Conference, i + 1, parent=p_key) for i in range(CONFERENCES)]
+    batch = []
+    for i in range(count):
+        c_key = c_keys[i % CONFERENCES]
+        batch.append(Session(parent=c_key, name='Session %d' % i,
+            speaker='Speaker %d' % (i % 500), duration=60,
+            typeOfSession=random.choice(types),
+            startTime=dtime(random.randint(8, 19), random.choice([0, 15, 30, 45])),
+            websafeConferenceKey=c_key.urlsafe()))
+        if len(batch) == PUT_BATCH_SIZE:
+            ndb.put_multi(batch)
+            batch = []
+    ndb.put_multi(batch)
+    return c_keys
+
+
+def legacyQuery(typeOfSession, startTime):
+    """The "!=" query plus Python filter formerly used by the endpoint."""
+    from models import Session
+    result = Session.query(Session.typeOfSession != typeOfSession)
+    requestTime = datetime.strptime(startTime, "%H:%M").time()
+    return [session for session in result
+            if session.startTime and session.startTime < requestTime]
+
+
+def plannedQuery(typeOfSession, startTime, c_key=None):
+    """The projection query plan now used by the endpoint."""
+    from conference import ConferenceApi
+    requestTime = datetime.strptime(startTime, "%H:%M").time()
+    return ConferenceApi._sessionsBeforeTime(typeOfSession,
+        requestTime.hour * 60 + requestTime.minute, c_key)
+
+
+def bench(label, func, *args):
+    """Run func REPEAT times, clearing the ndb context cache each time,
+    and print the best wall-clock time."""
+    best = None
+    for _ in range(REPEAT):
+        ndb.get_context().clear_cache()
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print '%-40s %8.3f s  (%d sessions)' % (label, best, len(result))
+    return result
+
+
+def main(count):
+    print 'Seeding %d sessions...' % count
+    c_keys = seed(count)
+    for typeOfSession, startTime in [('WORKSHOP', '19:00'), ('LECTURE', '10:00')]:
+        print 'Not %s, starting before %s' % (typeOfSession, startTime)
+        old = bench('  legacy "!=" + Python filter', legacyQuery,
+                    typeOfSession, startTime)
+        new = bench('  per-type projection plan', plannedQuery,
+                    typeOfSession, startTime)
+        assert set(s.key for s in old) == set(s.key for s in new)
+        bench('  per-type projection plan, 1 conference', plannedQuery,
+              typeOfSession, startTime, c_keys[0])
+
+
+if __name__ == '__main__':
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(consistency_policy=
+        datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    ndb.get_context().set_cache_policy(False)
+    try:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SESSIONS)
+    finally:
+        tb.deactivate()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""build_assets.py
+
+Conference Organization static asset pipeline
+
+Concatenates and minifies the local stylesheets into one CSS bundle and
+the application scripts, followed by the Angular partials pre-compiled
+into the $templateCache, into one JS bundle. Bundles are written to
+static/dist with the hash of their content in their file name, so
+app.yaml serves /dist with a far-future expiration: a changed bundle
+gets a new URL. The <!-- assets:css --> and <!-- assets:js --> blocks
+of templates/index.html are rewritten to load the bundles.
+
+Run from the repository root after changing a stylesheet, script or
+partial, and before deploying:
+
+    python build_assets.py
+
+With --dev the blocks load the separate source files again (and the
+partials from /partials), for editing them on the development server.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DIST_DIR = os.path.join(ROOT, 'static', 'dist')
+DIST_URL = '/dist'
+INDEX = os.path.join(ROOT, 'templates', 'index.html')
+PARTIALS = os.path.join(ROOT, 'static', 'partials')
+PARTIALS_URL = '/partials'
+HASH_LENGTH = 12
+
+# bundle -> [(source file, URL serving it in --dev)], in load order
+BUNDLES = {
+    'css': [
+        ('static/bootstrap/css/bootstrap-cosmo.css', '/css/bootstrap-cosmo.css'),
+        ('static/bootstrap/css/main.css', '/css/main.css'),
+        ('static/bootstrap/css/offcanvas.css', '/css/offcanvas.css'),
+    ],
+    'js': [
+        ('static/js/app.js', '/js/app.js'),
+        ('static/js/controllers.js', '/js/controllers.js'),
+    ],
+}
+TAGS = {
+    'css': '<link rel="stylesheet" href="%s">',
+    'js': '<script src="%s"></script>',
+}
+# the module the partials are put in the $templateCache of
+TEMPLATE_MODULE = 'conferenceApp'
+
+_BLOCK = re.compile(r'^([ \t]*)<!-- assets:(\w+) -->\n.*?^[ \t]*<!-- /assets:\2 -->$',
+                    re.MULTILINE | re.DOTALL)
+_WORD = re.compile(r'[\w$]')
+# characters after which a / starts a regular expression, not a division
+_REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'in', 'delete', 'void')
+
+
+def _stringEnd(source, start):
+    """Return the index after the string literal starting at start."""
+    quote = source[start]
+    i = start + 1
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+            continue
+        if source[i] == quote:
+            return i + 1
+        i += 1
+    raise ValueError('Unterminated string at %d' % start)
+
+
+def _regexEnd(source, start):
+    """Return the index after the regular expression literal, flags
+    included, starting at start."""
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '\n':
+            break
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(source) and _WORD.match(source[i]):
+                i += 1
+            return i
+        i += 1
+    raise ValueError('Unterminated regular expression at %d' % start)
+
+
+def minifyJs(source):
+    """Strip the comments, indentation and blank lines of JavaScript
+    source and collapse the remaining whitespace.
+
+    Line breaks are kept, so automatic semicolon insertion is not
+    affected; string and regular expression literals are left as is.
+    """
+    out = []
+    pending = None  # whitespace seen since the last token: ' ' or '\n'
+    last = ''       # last token emitted
+    i = 0
+    n = len(source)
+
+    def emit(token):
+        if out and pending == '\n':
+            out.append('\n')
+        elif out and pending == ' ' and (
+                _WORD.match(last[-1]) and _WORD.match(token[0]) or
+                last[-1] in '+-' and token[0] == last[-1]):
+            out.append(' ')
+        out.append(token)
+
+    while i < n:
+        c = source[i]
+        if c.isspace():
+            j = i
+            while j < n and source[j].isspace():
+                j += 1
+            if pending != '\n':
+                pending = '\n' if '\n' in source[i:j] else ' '
+            i = j
+            continue
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end < 0:
+                raise ValueError('Unterminated comment at %d' % i)
+            if pending is None:
+                pending = ' '
+            i = end + 2
+            continue
+        if c in '\'"':
+            j = _stringEnd(source, i)
+        elif c == '/' and (not last or last[-1] in _REGEX_PREFIX or
+                           last in _REGEX_KEYWORDS):
+            j = _regexEnd(source, i)
+        elif _WORD.match(c):
+            j = i
+            while j < n and _WORD.match(source[j]):
+                j += 1
+        else:
+            j = i + 1
+        token = source[i:j]
+        emit(token)
+        last = token
+        pending = None
+        i = j
+    return ''.join(out) + '\n'
+
+
+def _compactCss(css):
+    """Remove the whitespace of stylesheet code (strings excluded) that
+    does not separate anything."""
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r' ?([{};,>]) ?', r'\1', css)
+    return re.sub(r': ', ':', css).replace(';}', '}')
+
+
+def minifyCss(source):
+    """Strip the comments of a stylesheet and the whitespace that does
+    not separate anything; strings are left as is."""
+    out = []
+    code = []
+    i = 0
+    n = len(source)
+    while i < n:
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end < 0:
+                raise ValueError('Unterminated comment at %d' % i)
+            code.append(' ')
+            i = end + 2
+        elif source[i] in '\'"':
+            j = _stringEnd(source, i)
+            out.append(_compactCss(''.join(code)))
+            out.append(source[i:j])
+            code = []
+            i = j
+        else:
+            code.append(source[i])
+            i += 1
+    out.append(_compactCss(''.join(code)))
+    return ''.join(out).strip() + '\n'
+
+
+def templateCacheJs():
+    """Return JavaScript putting every partial in the $templateCache
+    under the URL the routes and modals load it from."""
+    lines = ["angular.module('%s').run(['$templateCache', function ($templateCache) {"
+             % TEMPLATE_MODULE]
+    for path in sorted(glob.glob(os.path.join(PARTIALS, '*.html'))):
+        with open(path) as f:
+            content = f.read()
+        url = '%s/%s' % (PARTIALS_URL, os.path.basename(path))
+        lines.append('    $templateCache.put(%s, %s);' % (json.dumps(url),
+                                                          json.dumps(content)))
+    lines.append('}]);')
+    return '\n'.join(lines) + '\n'
+
+
+def _read(path):
+    with open(os.path.join(ROOT, path)) as f:
+        return f.read()
+
+
+def buildBundle(kind):
+    """Write the minified bundle of kind to DIST_DIR, removing its former
+    versions; returns its URL."""
+    if kind == 'css':
+        content = ''.join(minifyCss(_read(path)) for path, _ in BUNDLES[kind])
+    else:
+        # every file on its own lines, in case one lacks a final semicolon
+        content = ';\n'.join(minifyJs(_read(path)) for path, _ in BUNDLES[kind])
+        content += ';\n' + minifyJs(templateCacheJs())
+    digest = hashlib.md5(content).hexdigest()[:HASH_LENGTH]
+    name = 'app.%s.%s' % (digest, kind)
+    if not os.path.isdir(DIST_DIR):
+        os.makedirs(DIST_DIR)
+    for old in glob.glob(os.path.join(DIST_DIR, 'app.*.%s' % kind)):
+        if os.path.basename(old) != name:
+            os.remove(old)
+    with open(os.path.join(DIST_DIR, name), 'w') as f:
+        f.write(content)
+    return '%s/%s' % (DIST_URL, name)
+
+
+def rewriteIndex(urls):
+    """Make the asset blocks of INDEX load urls, by bundle kind."""
+    with open(INDEX) as f:
+        html = f.read()
+
+    def block(match):
+        indent, kind = match.group(1), match.group(2)
+        tags = ['%s<!-- assets:%s -->' % (indent, kind)]
+        tags += [indent + TAGS[kind] % url for url in urls[kind]]
+        tags.append('%s<!-- /assets:%s -->' % (indent, kind))
+        return '\n'.join(tags)
+
+    html, count = _BLOCK.subn(block, html)
+    if count != len(BUNDLES):
+        raise ValueError('%s should have one asset block per bundle' % INDEX)
+    with open(INDEX, 'w') as f:
+        f.write(html)
+
+
+def main(args):
+    if args.dev:
+        urls = dict((kind, [url for _, url in files])
+                    for kind, files in BUNDLES.items())
+    else:
+        urls = dict((kind, [buildBundle(kind)]) for kind in BUNDLES)
+    rewriteIndex(urls)
+    for kind in sorted(urls):
+        print '%s: %s' % (kind, ', '.join(urls[kind]))
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dev', action='store_true',
+        help='load the separate source files instead of the bundles')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parseArgs())
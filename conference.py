@@ -10,18 +10,33 @@ __author__ = 'd.nastri@gmail.com (Davide Nastri)'
 
 
 from datetime import datetime
+import hashlib
+import operator
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
 from models import Profile
+from models import Registration
+from models import WishlistEntry
+from models import WishlistModifyForm
+from models import WebsafeKeysForm
+from models import ConferenceBatchItemForm
+from models import ConferenceBatchForms
+from models import SessionBatchItemForm
+from models import SessionBatchForms
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import BooleanMessage
@@ -30,24 +45,65 @@ from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import QueryPlanForm
+from models import ConferenceSearchForm
+from models import ConferenceSummaryForms
+from models import ConferenceSearchForms
+from models import FacetForm
+from models import FacetValueForm
 from models import TeeShirtSize
 from models import StringMessage
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionType
+from models import SpeakerStats
+from models import Speaker
+from models import SpeakerForm
+from models import SpeakerForms
 
 from utils import getUserId
+from utils import normalizeSpeaker
+from utils import normalizeSessionType
+
+import counters
+import entitycache
+import instrumentation
+import notifications
+import searchindex
+
+from mappers import conferenceSummaryMapper
+from mappers import conferenceToForm
+from mappers import profileToForm
+from mappers import sessionToForm
 
 from settings import WEB_CLIENT_ID
 
 import logging
 
-import pickle
-
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_ANNOUNCEMENT_REFRESH_KEY = "ANNOUNCEMENT_REFRESH"
+ANNOUNCEMENT_SEATS_THRESHOLD = 5
+ANNOUNCEMENT_MAX_AGE = 3900 # a bit more than the hourly cron
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
+BACKFILL_BATCH_SIZE = 100
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_WISHLIST_CHANGES = 100
+MAX_BATCH_KEYS = 300
+MEMCACHE_QUERY_CACHE_HITS_KEY = "QUERY_CACHE_HITS"
+MEMCACHE_QUERY_CACHE_MISSES_KEY = "QUERY_CACHE_MISSES"
+QUERY_CACHE_TIMEOUT = 600
+MEMCACHE_QUERY_ESTIMATE_KEY = "QUERY_ESTIMATE:%s:%s"
+ESTIMATE_LIMIT = 1000
+MAX_SCAN_ROWS = 1000
+MAX_SESSION_IMPORT = 500
+SESSION_PUT_BATCH_SIZE = 100
+# Conference properties of the conference list screens
+SUMMARY_FIELDS = ('name', 'city', 'startDate', 'endDate',
+                  'organizerDisplayName', 'maxAttendees', 'seatsAvailable')
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -74,19 +130,44 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+# in-memory versions of OPERATORS, for the filters not pushed to datastore
+PREDICATES = {
+            '=':  operator.eq,
+            '>':  operator.gt,
+            '>=': operator.ge,
+            '<':  operator.lt,
+            '<=': operator.le,
+            '!=': operator.ne,
+            }
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_GET_CONDITIONAL_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+    ifNoneMatch=messages.StringField(4),
 )
 
 SESSION_GET_REQUEST_BY_TYPE = endpoints.ResourceContainer(
@@ -99,21 +180,33 @@ SESSION_GET_REQUEST_BY_TYPE_AND_STARTTIME = endpoints.ResourceContainer(
     message_types.VoidMessage,
     typeOfSession=messages.StringField(1),
     startTime=messages.StringField(2),
+    websafeConferenceKey=messages.StringField(3),
     )
 
 SESSION_GET_REQUEST_BY_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
 )
 
 SESSION_GET_REQUEST_BY_NAME = endpoints.ResourceContainer(
     message_types.VoidMessage,
     name=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
 )
 
 SESSION_GET_REQUEST_BY_HIGHLIGHTS = endpoints.ResourceContainer(
     message_types.VoidMessage,
     highlights=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+FEATURED_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
 )
 
 SESSION_WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
@@ -141,24 +234,90 @@ SESSION_WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+# - - - Paging - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _pageArgs(self, request):
+        """Return the checked (page size, start cursor) of request."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException("Invalid pageToken.")
+        return page_size, cursor
+
+
+    def _fetchPage(self, query, request, **options):
+        """Fetch one page of query using request pageSize/pageToken and
+        query options (e.g. projection); returns (entities, nextPageToken)."""
+        page_size, cursor = self._pageArgs(request)
+
+        # a single fetch per page, whatever the size of the result set
+        entities, next_cursor, more = query.fetch_page(
+            page_size, start_cursor=cursor, **options)
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return entities, next_token
+
+
+    def _slicePage(self, items, request):
+        """Return one page of an in-memory list using request
+        pageSize/pageToken (an offset); returns (items, nextPageToken)."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        try:
+            start = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        end = start + page_size
+        next_token = str(end) if end < len(items) else None
+        return items[start:end], next_token
+
+    def _websafeKeys(self, websafe_keys, model):
+        """Return ndb Keys of model for websafe key strings, raising
+        BadRequest on malformed keys or keys of another kind."""
+        keys = []
+        for wsk in websafe_keys:
+            try:
+                key = ndb.Key(urlsafe=wsk)
+            except Exception:
+                raise endpoints.BadRequestException('Invalid key: %s' % wsk)
+            if key.kind() != model._get_kind():
+                raise endpoints.BadRequestException(
+                    'Not a %s key: %s' % (model._get_kind(), wsk))
+            keys.append(key)
+        return keys
+
+    def _getBatch(self, websafe_keys, model):
+        """Get the entities of model for websafe keys with one get_multi;
+        returns them in request order, None for malformed or missing keys."""
+        if len(websafe_keys) > MAX_BATCH_KEYS:
+            raise endpoints.BadRequestException(
+                'At most %d keys per batch.' % MAX_BATCH_KEYS)
+        keys = []
+        for wsk in websafe_keys:
+            try:
+                key = ndb.Key(urlsafe=wsk)
+            except Exception:
+                key = None
+            if key and key.kind() != model._get_kind():
+                key = None
+            keys.append(key)
+        entities = iter(ndb.get_multi([key for key in keys if key]))
+        return [next(entities) if key else None for key in keys]
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    @instrumentation.timed('serialization')
+    def _copyConferenceToForm(self, conf):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        # field mapping and Date conversion are precompiled in mappers.py
+        return conferenceToForm(conf)
 
 
     def _createConferenceObject(self, request):
@@ -176,6 +335,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -196,22 +357,39 @@ class ConferenceApi(remote.Service):
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
         # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
+        # ID based on Profile key get Conference key from ID;
+        # the Profile is loaded at the same time
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
+        c_ids = Conference.allocate_ids_async(size=1, parent=p_key)
+        prof = self._getProfileAsync(user)
+        c_key = ndb.Key(Conference, c_ids.get_result()[0], parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        # TODO 2: add confirmation email sending task to queue
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # store organizer name on the Conference so reads skip the Profile
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            prof.get_result().displayName or ''
+
+        # create Conference and its seat counters together
+        conf = Conference(**data)
+        ndb.Future.wait_all([conf.put_async(),
+            counters.createSeatShardsAsync(c_key, data['seatsAvailable'])])
+
+        # once stored, invalidate cached queries and queue the email to
+        # organizer confirming creation of Conference (sent in batches)
+        # & return (modified) ConferenceForm
+        bump = entitycache.bumpAsync(self._conferenceGenerationKey())
+        email = notifications.enqueueConfirmationAsync(c_key)
+        index = searchindex.indexConferencesAsync([conf])
+        bump.get_result()
+        email.get_result()
+        try:
+            index.get_result()
+        except search.Error:
+            # the task retries until the conference is searchable
+            logging.exception('Could not index conference %s', c_key.urlsafe())
+            taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe()},
+                url='/tasks/index_conference'
+            )
         return request
 
 
@@ -239,7 +417,14 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        old_max = conf.maxAttendees or 0
         for field in request.all_fields():
+            # organizer name is owned by the Profile, not the request,
+            # seatsAvailable by the seat counters, the ETag fields are
+            # outbound only
+            if field.name in ('organizerDisplayName', 'seatsAvailable',
+                              'etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -250,42 +435,106 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # move the seat counters by the change of maxAttendees, once
+        # this transaction has committed
+        delta = (conf.maxAttendees or 0) - old_max
+        if delta:
+            conf.seatsAvailable = max((conf.seatsAvailable or 0) + delta, 0)
+            taskqueue.add(params={'websafeConferenceKey': request.websafeConferenceKey,
+                'delta': delta},
+                url='/tasks/adjust_seats',
+                transactional=True
+            )
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # refresh the search document once this transaction has committed
+        taskqueue.add(params={'websafeConferenceKey': request.websafeConferenceKey},
+            url='/tasks/index_conference',
+            transactional=True
+        )
+        return self._copyConferenceToForm(conf)
 
 
-    @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
+    @instrumentation.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
 
 
-    @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
+    @instrumentation.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        conf_form = self._updateConferenceObject(request)
+        # only invalidate cached queries and entities once the
+        # transaction committed
+        self._bumpConferenceGeneration()
+        entitycache.bump(ndb.Key(urlsafe=request.websafeConferenceKey))
+        return conf_form
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @staticmethod
+    def _conferenceETag(version, seats):
+        """Return the ETag of a Conference read, made of its entity
+        version and live seat count (registrations do not put the
+        Conference), or of its version alone when it has no seat shards;
+        None when the version is not known."""
+        if version is None:
+            return None
+        if seats is None:
+            return 'c%d' % version
+        return 'c%d-%d' % (version, seats)
+
+
+    @instrumentation.method(CONF_GET_CONDITIONAL_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        """Return requested conference (by websafeConferenceKey).
+
+        When ifNoneMatch holds the etag of the current conference, only
+        the etag is returned with notModified set, without reading the
+        Conference.
+        """
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        # entity version and live seat count in one memcache batch; the
+        # seat count is summed from the shards and cached again when it
+        # expired, so the etag outlives the seat cache
+        version = entitycache.versionAsync(c_key)
+        seats = counters.getSeatsAvailableAsync(c_key)
+        etag = self._conferenceETag(version.get_result(), seats.get_result())
+        if etag and etag == request.ifNoneMatch:
+            return ConferenceForm(etag=etag, notModified=True)
+
+        # bail if not found
+        conf = entitycache.getAsync(c_key, version.get_result()).get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
-
-
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+        # return ConferenceForm with live seat count
+        if seats.get_result() is not None:
+            conf.seatsAvailable = seats.get_result()
+        conf_form = self._copyConferenceToForm(conf)
+        conf_form.etag = etag
+        return conf_form
+
+
+    @instrumentation.method(WebsafeKeysForm, ConferenceBatchForms,
+            path='conferences/batch',
+            http_method='POST', name='getConferencesBatch')
+    def getConferencesBatch(self, request):
+        """Return the conferences of up to MAX_BATCH_KEYS websafe keys,
+        in request order, flagging the ones not found."""
+        confs = self._getBatch(request.websafeKeys, Conference)
+        return ConferenceBatchForms(items=[
+            ConferenceBatchItemForm(websafeKey=wsck, found=bool(conf),
+                conference=self._copyConferenceToForm(conf) if conf else None)
+            for wsck, conf in zip(request.websafeKeys, confs)])
+
+
+    @instrumentation.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
@@ -297,17 +546,18 @@ class ConferenceApi(remote.Service):
         user_id =  getUserId(user)
         # create ancestor query for all key matches for this user
         confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs, next_token = self._fetchPage(confs, request)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf) for conf in confs],
+            nextPageToken=next_token
         )
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+    def _getQuery(self, inequality_filter, filters):
+        """Return formatted query from the formatted filters, which have
+        inequalities on inequality_filter only."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -317,17 +567,18 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
+        # key order keeps page cursors valid for "!=" (multi) queries
+        q = q.order(Conference.key)
         return q
 
 
     def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters;
+        returns (fields with inequalities in request order, filters)."""
         formatted_filters = []
-        inequality_field = None
+        inequality_fields = []
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -338,47 +589,369 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value of %s must be a number." % filtr["field"])
+
+            # Every operation except "=" is an inequality; track the
+            # fields they are on, the query planner handles several
+            if filtr["operator"] != "=" and filtr["field"] not in inequality_fields:
+                inequality_fields.append(filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return (inequality_fields, formatted_filters)
+
+
+    @staticmethod
+    def _describeFilter(filtr):
+        return '%s %s %s' % (filtr["field"], filtr["operator"], filtr["value"])
+
+
+    @ndb.tasklet
+    def _estimateRowsAsync(self, field, filters):
+        """Tasklet estimating the Conferences matching the filters on
+        field alone: keys are counted on its built-in index, up to
+        ESTIMATE_LIMIT, and cached until the conferences change."""
+        ctx = ndb.get_context()
+        signature = repr(sorted((f["operator"], f["value"]) for f in filters))
+        cache_key = MEMCACHE_QUERY_ESTIMATE_KEY % (self._conferenceGeneration(),
+            hashlib.sha1('%s:%s' % (field, signature)).hexdigest())
+        estimate = yield ctx.memcache_get(cache_key)
+        if estimate is None:
+            q = Conference.query(*[ndb.query.FilterNode(f["field"],
+                f["operator"], f["value"]) for f in filters])
+            estimate = yield q.count_async(limit=ESTIMATE_LIMIT)
+            yield ctx.memcache_set(cache_key, estimate, time=QUERY_CACHE_TIMEOUT)
+        raise ndb.Return(estimate)
+
+
+    @staticmethod
+    def _matches(value, filtr):
+        """Apply a filter in memory the way datastore does: entities
+        without the property never match, repeated properties match if
+        any of their values does."""
+        predicate = PREDICATES[filtr["operator"]]
+        values = value if isinstance(value, list) else [value]
+        return any(v is not None and predicate(v, filtr["value"]) for v in values)
+
+
+    def _plannedQuery(self, request, inequality_fields, filters, plan):
+        """Run a query with inequalities on several fields.
+
+        The inequalities on the field matching the fewest conferences
+        (estimated by _estimateRowsAsync) go to datastore with all the
+        equalities. The other ones are checked in memory while streaming
+        keys with the projected values they need, and only the
+        conferences of the surviving keys are loaded. A projection yields
+        a row per value of a repeated property, rows that may fall on
+        different pages, so a plan on topics streams the conferences
+        themselves instead, which datastore returns once. A page stops at
+        pageSize matches or MAX_SCAN_ROWS scanned rows, so it may be
+        short; nextPageToken continues the scan. Results are ordered by
+        the pushed down field, or by key when the plan lacks an index and
+        only the equalities go to datastore. Returns (conferences,
+        nextPageToken).
+        """
+        page_size, cursor = self._pageArgs(request)
+
+        # estimate every candidate field at once
+        futures = [(field, self._estimateRowsAsync(field,
+            [f for f in filters if f["field"] == field and f["operator"] != "="]))
+            for field in inequality_fields]
+        estimates = dict((field, future.get_result()) for field, future in futures)
+        pushed = min(inequality_fields,
+            key=lambda field: (estimates[field], inequality_fields.index(field)))
+
+        pushed_filters = [f for f in filters
+                          if f["operator"] == "=" or f["field"] == pushed]
+        residual = [f for f in filters
+                    if f["operator"] != "=" and f["field"] != pushed]
+        checked = set(f["field"] for f in residual)
+        # equality filtered single-valued properties cannot be projected,
+        # and are known; a repeated one may match on other values
+        known = dict((f["field"], f["value"]) for f in filters
+                     if f["operator"] == "=" and
+                     not Conference._properties[f["field"]]._repeated)
+        entities = any(Conference._properties[field]._repeated
+                       for field in checked | set([pushed]))
+        projection = [] if entities else sorted(checked - set(known))
+
+        q = Conference.query(*[ndb.query.FilterNode(f["field"], f["operator"],
+            f["value"]) for f in pushed_filters])
+        # key order keeps page cursors valid for "!=" (multi) queries
+        q = q.order(ndb.GenericProperty(pushed), Conference.key)
+        strategy = 'planned'
+        try:
+            conferences, scanned, next_token = self._scanPlan(q, cursor,
+                page_size, residual, known, entities, projection)
+        except datastore_errors.NeedIndexError:
+            # index.yaml covers the usual plans only. Equality filters
+            # alone are served by merging the built-in indexes, so check
+            # every inequality in memory instead; every page of such a
+            # filter set falls back, so its cursors stay consistent.
+            logging.warning('No index for the plan of %s',
+                ', '.join(self._describeFilter(f) for f in filters))
+            strategy = 'planned-fallback'
+            pushed_filters = [f for f in filters if f["operator"] == "="]
+            residual = [f for f in filters if f["operator"] != "="]
+            projection = []
+            q = Conference.query(*[ndb.query.FilterNode(f["field"],
+                f["operator"], f["value"]) for f in pushed_filters])
+            conferences, scanned, next_token = self._scanPlan(q, cursor,
+                page_size, residual, {}, True, projection)
+
+        plan.strategy = strategy
+        plan.pushedDown = [self._describeFilter(f) for f in pushed_filters]
+        plan.inMemory = [self._describeFilter(f) for f in residual]
+        plan.projection = projection
+        plan.estimates = ['%s: %d%s' % (field, estimates[field],
+            '+' if estimates[field] >= ESTIMATE_LIMIT else '')
+            for field in inequality_fields]
+        plan.scanned = scanned
+        plan.matched = len(conferences)
+        return conferences, next_token
+
+
+    def _scanPlan(self, q, cursor, page_size, residual, known, entities,
+                  projection):
+        """Stream the rows of a planned query from cursor, checking the
+        residual filters in memory on the conferences themselves
+        (entities), on projected values or, for keys only rows, on the
+        known equality values; returns (matching conferences, rows
+        scanned, nextPageToken)."""
+        checked = set(f["field"] for f in residual)
+        if entities:
+            it = q.iter(start_cursor=cursor, produce_cursors=True)
+        elif projection:
+            it = q.iter(projection=projection, start_cursor=cursor,
+                        produce_cursors=True)
+        else:
+            it = q.iter(keys_only=True, start_cursor=cursor,
+                        produce_cursors=True)
+
+        keys, matched, seen, scanned, next_token = [], {}, set(), 0, None
+        for row in it:
+            scanned += 1
+            key = row.key if entities or projection else row
+            if entities:
+                values = dict((field, getattr(row, field)) for field in checked)
+            else:
+                values = dict(known)
+                values.update((field, getattr(row, field)) for field in projection)
+            if key not in seen and all(self._matches(values.get(f["field"]), f)
+                                       for f in residual):
+                # "!=" multi-queries may yield a key more than once
+                seen.add(key)
+                keys.append(key)
+                if entities:
+                    matched[key] = row
+            if len(keys) == page_size or scanned >= MAX_SCAN_ROWS:
+                if it.has_next():
+                    next_token = it.cursor_after().urlsafe()
+                break
+
+        if entities:
+            return [matched[key] for key in keys], scanned, next_token
+        return ([conf for conf in ndb.get_multi(keys) if conf], scanned,
+                next_token)
 
 
-    @endpoints.method(ConferenceQueryForms, ConferenceForms,
+    @staticmethod
+    def _conferenceGenerationKey():
+        """Return the key, versioned by entitycache, of all Conferences."""
+        return ndb.Key('ConferenceGeneration', 1)
+
+
+    @staticmethod
+    def _conferenceGeneration():
+        """Return the current conference generation: the entitycache
+        version of all Conferences."""
+        return entitycache.versionAsync(
+            ConferenceApi._conferenceGenerationKey()).get_result()
+
+
+    @staticmethod
+    def _bumpConferenceGeneration():
+        """Invalidate all cached queryConferences results; called after
+        every Conference create and update and by the seat reconciliation.
+        """
+        entitycache.bump(ConferenceApi._conferenceGenerationKey())
+
+
+    def _queryCacheKey(self, filters, request, prefix="QUERY_CONFERENCES"):
+        """Return the memcache key for formatted filters and paging."""
+        normalized = []
+        for filtr in filters:
+            value = filtr["value"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    pass
+            normalized.append((filtr["field"], filtr["operator"], value))
+        # filter order does not change the result, so sort it away
+        normalized.sort()
+        signature = repr((normalized, request.pageSize or DEFAULT_PAGE_SIZE,
+            request.pageToken))
+        return "%s:%s:%s" % (prefix, self._conferenceGeneration(),
+            hashlib.sha1(signature).hexdigest())
+
+
+    @staticmethod
+    def _queryCacheStats():
+        """Return queryConferences cache counters; used by the admin
+        stats handler.
+        """
+        stats = memcache.get_multi([MEMCACHE_QUERY_CACHE_HITS_KEY,
+            MEMCACHE_QUERY_CACHE_MISSES_KEY])
+        return {
+            'hits': stats.get(MEMCACHE_QUERY_CACHE_HITS_KEY, 0),
+            'misses': stats.get(MEMCACHE_QUERY_CACHE_MISSES_KEY, 0),
+            'generation': ConferenceApi._conferenceGeneration(),
+        }
+
+
+    @instrumentation.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        """Query for conferences; with debug set, the query plan is
+        returned too."""
+        # serve popular filter sets straight from memcache; debug
+        # requests always run, to report their plan
+        inequality_fields, filters = self._formatFilters(request.filters)
+        cache_key = self._queryCacheKey(filters, request)
+        if not request.debug:
+            cached = memcache.get(cache_key)
+            if cached is not None:
+                memcache.incr(MEMCACHE_QUERY_CACHE_HITS_KEY, initial_value=0)
+                return protojson.decode_message(ConferenceForms, cached)
+            memcache.incr(MEMCACHE_QUERY_CACHE_MISSES_KEY, initial_value=0)
+
+        plan = QueryPlanForm()
+        if len(inequality_fields) > 1:
+            conferences, next_token = self._plannedQuery(request,
+                inequality_fields, filters, plan)
+        else:
+            query = self._getQuery(
+                inequality_fields[0] if inequality_fields else None, filters)
+            conferences, next_token = self._fetchPage(query, request)
+            plan.strategy = 'datastore'
+            plan.pushedDown = [self._describeFilter(f) for f in filters]
+            plan.matched = len(conferences)
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+        forms = ConferenceForms(
+                items=[self._copyConferenceToForm(conf) for conf in conferences],
+                nextPageToken=next_token
+        )
+        memcache.set(cache_key, protojson.encode_message(forms),
+            time=QUERY_CACHE_TIMEOUT)
+        if request.debug:
+            forms.plan = plan
+        return forms
+
+    @instrumentation.method(ConferenceQueryForms, ConferenceSummaryForms,
+            path='queryConferences/summary',
+            http_method='POST',
+            name='queryConferenceSummaries')
+    def queryConferenceSummaries(self, request):
+        """Query for conferences like queryConferences, returning only
+        the fields of the conference lists."""
+        inequality_fields, filters = self._formatFilters(request.filters)
+        cache_key = self._queryCacheKey(filters, request,
+            prefix="QUERY_CONFERENCE_SUMMARIES")
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            memcache.incr(MEMCACHE_QUERY_CACHE_HITS_KEY, initial_value=0)
+            return protojson.decode_message(ConferenceSummaryForms, cached)
+        memcache.incr(MEMCACHE_QUERY_CACHE_MISSES_KEY, initial_value=0)
+
+        known = {}
+        if len(inequality_fields) > 1:
+            # planned queries load the conferences that survive anyway
+            conferences, next_token = self._plannedQuery(request,
+                inequality_fields, filters, QueryPlanForm())
+            projection = SUMMARY_FIELDS
+        else:
+            # a projection query reads the summary straight from the
+            # index, without loading the entities; properties with an
+            # equality filter cannot be projected, their value is known
+            known = dict((f["field"], f["value"]) for f in filters
+                if f["operator"] == "=" and f["field"] in SUMMARY_FIELDS)
+            projection = [field for field in SUMMARY_FIELDS if field not in known]
+            query = self._getQuery(
+                inequality_fields[0] if inequality_fields else None, filters)
+            try:
+                conferences, next_token = self._fetchPage(query, request,
+                    projection=projection)
+            except datastore_errors.NeedIndexError:
+                # index.yaml covers the usual filter sets only; load the
+                # entities for the others. Every page of such a filter
+                # set falls back, so its cursors stay consistent.
+                logging.warning('No projection index for %s',
+                    ', '.join(self._describeFilter(f) for f in filters))
+                known = {}
+                projection = SUMMARY_FIELDS
+                conferences, next_token = self._fetchPage(query, request)
+
+        mapper = conferenceSummaryMapper(projection)
+        forms = ConferenceSummaryForms(nextPageToken=next_token)
+        seen = set()
+        for conf in conferences:
+            # an inequality on topics yields a row per matching topic
+            if conf.key in seen:
+                continue
+            seen.add(conf.key)
+            form = mapper(conf)
+            for field, value in known.items():
+                setattr(form, field, value)
+            forms.items.append(form)
+        memcache.set(cache_key, protojson.encode_message(forms),
+            time=QUERY_CACHE_TIMEOUT)
+        return forms
+
+    @instrumentation.method(ConferenceSearchForm, ConferenceSearchForms,
+            path='conferences/search',
+            http_method='POST', name='searchConferences')
+    def searchConferences(self, request):
+        """Full-text search of conferences by name, description and
+        organizer, with city/topic/month facets, sort and paging."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        sort = request.sort or 'relevance'
+        if sort not in searchindex.SORTS:
+            raise endpoints.BadRequestException("sort must be one of: %s." %
+                ', '.join(sorted(searchindex.SORTS)))
+        try:
+            results = searchindex.searchConferences(request.query, sort,
+                request.refinementTokens, page_size, request.pageToken,
+                request.onlyAvailable)
+        except (ValueError, search.InvalidRequest):
+            raise endpoints.BadRequestException(
+                "Invalid pageToken or refinementTokens.")
+
+        # documents only hold the keys, conferences come in one get_multi
+        confs = ndb.get_multi([ndb.Key(urlsafe=doc.doc_id) for doc in results])
+        return ConferenceSearchForms(
+            items=[self._copyConferenceToForm(conf) for conf in confs if conf],
+            facets=[FacetForm(name=facet.name, values=[
+                FacetValueForm(label=value.label, count=value.count,
+                    refinementToken=value.refinement_token)
+                for value in facet.values]) for facet in results.facets],
+            totalMatches=results.number_found,
+            nextPageToken=results.cursor.web_safe_string if results.cursor else None
         )
 
 # - - - Session objects - - - - - - - - - - - - - -
 
-    @endpoints.method(SessionForm, SessionForm,
+    @instrumentation.method(SessionForm, SessionForm,
             path='createSession',
             http_method='POST', name='createSession')
     def createSession(self, request):
@@ -386,39 +959,56 @@ class ConferenceApi(remote.Service):
         return self._createSessionObject(request)
 
 
+    @instrumentation.timed('serialization')
     def _copySessionToForm(self, session):
         """Copy fields from Session to SessionForm."""
-        session_form = SessionForm()
-        for field in session_form.all_fields():
-            try:
-                if field.name == 'startTime':
-                    session_form.startTime = str(session.startTime)
-                elif field.name == 'date':
-                    session_form.date = str(session.date)
-                elif hasattr(session, field.name):
-                    setattr(session_form, field.name, getattr(session, field.name))
-                elif field.name == "sessionSafeKey":
-                    setattr(session_form, field.name, session.key.urlsafe())
-            except AttributeError:
-                raise endpoints.BadRequestException("Error, check the input fields.")
-        session_form.check_initialized()
-        return session_form
-
-
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+        # field mapping and Date/Time conversion are precompiled in mappers.py
+        try:
+            return sessionToForm(session)
+        except AttributeError:
+            raise endpoints.BadRequestException("Error, check the input fields.")
+
+
+    @instrumentation.method(SESSION_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
-        """Given a conference, returns all sessions."""
+        """Given a conference, returns all sessions.
+
+        The etag is the version of the whole session set of the
+        conference, to be sent back as ifNoneMatch with the same page
+        request; when it still matches only the etag is returned with
+        notModified set, answered from memcache alone.
+        """
         wsck = request.websafeConferenceKey
         c_key = ndb.Key(urlsafe=wsck)
+        version = self._sessionSetVersionAsync(c_key).get_result()
+        etag = 's%d' % version if version is not None else None
+        if etag and etag == request.ifNoneMatch:
+            return SessionForms(etag=etag, notModified=True)
+
         sessions = Session.query(ancestor=c_key)
+        sessions, next_token = self._fetchPage(sessions, request)
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token,
+            etag=etag
         )
 
-    @endpoints.method(SESSION_GET_REQUEST_BY_TYPE, SessionForms,
+    @instrumentation.method(WebsafeKeysForm, SessionBatchForms,
+            path='sessions/batch',
+            http_method='POST', name='getSessionsBatch')
+    def getSessionsBatch(self, request):
+        """Return the sessions of up to MAX_BATCH_KEYS websafe keys,
+        in request order, flagging the ones not found."""
+        sessions = self._getBatch(request.websafeKeys, Session)
+        return SessionBatchForms(items=[
+            SessionBatchItemForm(websafeKey=wssk, found=bool(session),
+                session=self._copySessionToForm(session) if session else None)
+            for wssk, session in zip(request.websafeKeys, sessions)])
+
+    @instrumentation.method(SESSION_GET_REQUEST_BY_TYPE, SessionForms,
             path='conference/{websafeConferenceKey}/session/type/{typeOfSession}',
             http_method='GET', name='getConferenceSessionsByType')
     def getConferenceSessionsByType(self, request):
@@ -427,25 +1017,45 @@ class ConferenceApi(remote.Service):
         wsck = request.websafeConferenceKey
          # query datastore to obtain session that are related to request.websafeConferenceKey and request.typeOfSession
         c_key = ndb.Key(urlsafe=wsck)
-        sessions = Session.query(Session.typeOfSession == request.typeOfSession, ancestor=c_key)
+        sessions = Session.query(
+            Session.typeOfSession == normalizeSessionType(request.typeOfSession),
+            ancestor=c_key)
 
         return SessionForms(
             items=[self._copySessionToForm(session) for session in sessions]
         )
 
 
-    @endpoints.method(SESSION_GET_REQUEST_BY_SPEAKER, SessionForms,
+    @instrumentation.method(SESSION_GET_REQUEST_BY_SPEAKER, SessionForms,
             path='conference/sessions/speaker/{speaker}',
             http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """Given a speaker, returns all sessions given by this particular speaker."""
-        # query datastore to obtain session that are related to request.speaker
-        sessions = Session.query()
-        sessions = sessions.filter(Session.speaker == request.speaker)
-
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        if not (request.speaker or '').strip():
+            raise endpoints.BadRequestException("speaker is required")
+        # one get on the Speaker index, one get_multi for the sessions
+        speaker = ndb.Key(Speaker, normalizeSpeaker(request.speaker)).get()
+        session_keys = speaker.sessionKeys if speaker else []
+        session_keys, next_token = self._slicePage(session_keys, request)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in session_keys])
+        sessions = [session for session in sessions if session]
+
+        return SessionForms(items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token)
+
+    @instrumentation.method(CONF_LIST_REQUEST, SpeakerForms,
+            path='speakers',
+            http_method='GET', name='getSpeakers')
+    def getSpeakers(self, request):
+        """Return speakers with their number of sessions."""
+        speakers, next_token = self._fetchPage(Speaker.query(), request)
+        return SpeakerForms(
+            items=[SpeakerForm(name=sp.name, sessionCount=sp.sessionCount)
+                   for sp in speakers],
+            nextPageToken=next_token
+        )
 
-    @endpoints.method(SESSION_GET_REQUEST_BY_NAME, SessionForms,
+    @instrumentation.method(SESSION_GET_REQUEST_BY_NAME, SessionForms,
             path='conference/sessions/name/{name}',
             http_method='GET', name='getSessionsByName')
     def getSessionsByName(self, request):
@@ -453,10 +1063,12 @@ class ConferenceApi(remote.Service):
         # query datastore to obtain session that are related to request.name
         sessions = Session.query()
         sessions = sessions.filter(Session.name == request.name)
+        sessions, next_token = self._fetchPage(sessions, request)
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        return SessionForms(items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token)
 
-    @endpoints.method(SESSION_GET_REQUEST_BY_HIGHLIGHTS, SessionForms,
+    @instrumentation.method(SESSION_GET_REQUEST_BY_HIGHLIGHTS, SessionForms,
             path='conference/sessions/highlights/{highlights}',
             http_method='GET', name='getSessionsByHighlights')
     def getSessionsByHighlights(self, request):
@@ -464,28 +1076,98 @@ class ConferenceApi(remote.Service):
         # query datastore to obtain session that are related to request.highlights
         sessions = Session.query()
         sessions = sessions.filter(Session.highlights == request.highlights)
+        sessions, next_token = self._fetchPage(sessions, request)
 
-        return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
+        return SessionForms(items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token)
 
-    @endpoints.method(SESSION_GET_REQUEST_BY_TYPE_AND_STARTTIME, SessionForms,
+    @staticmethod
+    def _sessionsBeforeTime(excluded_type, minutes, c_key=None):
+        """Return Sessions of any type but excluded_type starting before
+        minutes past midnight, optionally within one Conference.
+
+        Rather than a "!=" (two scans) plus filtering startTime in Python,
+        one projection query per remaining SessionType runs in parallel
+        with the startMinutes inequality on the (typeOfSession,
+        startMinutes) index; only the matching Sessions are then fetched.
+        """
+        futures = []
+        for session_type in SessionType:
+            if str(session_type) == excluded_type:
+                continue
+            query = Session.query(Session.typeOfSession == str(session_type),
+                                  Session.startMinutes < minutes,
+                                  ancestor=c_key)
+            futures.append(query.fetch_async(projection=[Session.startMinutes]))
+
+        # merge by key, ordered by start time
+        found = {}
+        for future in futures:
+            for projected in future.get_result():
+                found[projected.key] = projected.startMinutes
+        keys = sorted(found, key=lambda key: (found[key], key))
+        return [session for session in ndb.get_multi(keys) if session]
+
+
+    @instrumentation.method(SESSION_GET_REQUEST_BY_TYPE_AND_STARTTIME, SessionForms,
             path='sessions/lastquery',
             http_method='GET', name='getSessionsByTypeAndStartTime')
     def getConferenceSessionsByTypeAndStartTime(self, request):
         """Given a session Type and Start time returns all session with different type
-            and a startTime before what specified."""
-        # query datastore to obtain session that are different from specified type
-        result = Session.query(Session.typeOfSession != request.typeOfSession)
-        # turn startTime into time object
-        requestTime = datetime.strptime(request.startTime, "%H:%M").time()
-        # add to sessions list all session that have a startTime minor of requestTime
-        sessions = []
-        for session in result:
-            if session.startTime and session.startTime < requestTime:
-                sessions.append(session)
-
+            and a startTime before what specified, optionally in one conference."""
+        # turn startTime into minutes past midnight
+        try:
+            requestTime = datetime.strptime(request.startTime or '', "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException("startTime must be HH:MM")
+        minutes = requestTime.hour * 60 + requestTime.minute
+        c_key = None
+        if request.websafeConferenceKey:
+            c_key = self._websafeKeys([request.websafeConferenceKey], Conference)[0]
+
+        sessions = self._sessionsBeforeTime(
+            normalizeSessionType(request.typeOfSession), minutes, c_key)
         return SessionForms(items=[self._copySessionToForm(session) for session in sessions])
 
 
+    @staticmethod
+    def _backfillSessionIndex(cursor=None):
+        """Normalize typeOfSession and store startMinutes on one batch of
+        existing Sessions; returns the cursor of the next batch or None
+        when done."""
+        sessions, next_cursor, more = Session.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        for session in sessions:
+            session.typeOfSession = normalizeSessionType(session.typeOfSession)
+        # the put also writes the computed startMinutes
+        ndb.put_multi(sessions)
+        ConferenceApi._bumpSessionSetVersions(
+            set(session.key.parent() for session in sessions))
+        return next_cursor if more else None
+
+
+    @staticmethod
+    def _sessionSetKey(c_key):
+        """Return the key, versioned by entitycache, of the session set
+        of a Conference."""
+        return ndb.Key('SessionSet', 1, parent=c_key)
+
+
+    @staticmethod
+    def _sessionSetVersionAsync(c_key):
+        """Future of the entitycache version of the session set of a
+        Conference, bumped whenever one of its sessions is stored."""
+        return entitycache.versionAsync(ConferenceApi._sessionSetKey(c_key))
+
+
+    @staticmethod
+    def _bumpSessionSetVersions(c_keys):
+        """Change the session set version of the given Conferences; call
+        it once the sessions have been stored."""
+        entitycache.bumpMulti([ConferenceApi._sessionSetKey(c_key)
+                               for c_key in c_keys])
+
+
     def _createSessionObject(self, request):
         """Create or update Session object, returning SessionForm/request."""
         # check if user is authorized
@@ -499,77 +1181,133 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException("Field 'name' is mandatory")
 
         # get conference key
-        wsck = request.websafeConferenceKey
-        # get conference object
+        c_key = self._sessionConferenceKey(request)
+        # get conference object while allocating the new Session ID
+        # with Conference key as parent
+        s_ids = Session.allocate_ids_async(size=1, parent=c_key)
+        self._checkSessionOrganizer([c_key], user_id)
+
+        # make Session key from ID
+        s_key = ndb.Key(Session, s_ids.get_result()[0], parent=c_key)
+        session = self._sessionFromForm(request, s_key)
+        request.typeOfSession = session.typeOfSession
+
+        #  save session into database, speaker statistics follow in a task
+        self._storeSession(session)
+        self._bumpSessionSetVersions([c_key])
+
+        return request
+
+
+    @staticmethod
+    def _sessionConferenceKey(request):
+        """Return the Conference key of a SessionForm."""
         try:
-            conference = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+            return ndb.Key(urlsafe=request.websafeConferenceKey)
         except:
             raise endpoints.BadRequestException("Check your WebSafeConferenceKey")
-        # check that conference exists or not
-        if not conference:
-            raise endpoints.NotFoundException(
-                'Conference key not found: %s' % wsck)
-        # check that user is owner
-        if conference.organizerUserId != getUserId(endpoints.get_current_user()):
-            raise endpoints.ForbiddenException(
-                'Only the conference organizer can create a session.')
 
+
+    @staticmethod
+    def _checkSessionOrganizer(c_keys, user_id):
+        """Check, with one get_multi, that all the Conferences of c_keys
+        exist and are organized by user_id."""
+        for c_key, conference in zip(c_keys, ndb.get_multi(c_keys)):
+            # check that conference exists or not
+            if not conference:
+                raise endpoints.NotFoundException(
+                    'Conference key not found: %s' % c_key.urlsafe())
+            # check that user is owner
+            if conference.organizerUserId != user_id:
+                raise endpoints.ForbiddenException(
+                    'Only the conference organizer can create a session.')
+
+
+    @staticmethod
+    def _sessionFromForm(request, s_key):
+        """Return the Session of key s_key made from a SessionForm."""
         # copy SessionForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         # convert date and time from strings to Date objects;
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+        try:
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
 
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(data['startTime'][:10],  "%H:%M").time()
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'][:10],  "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Session '%s': dates are YYYY-MM-DD and times HH:MM" % request.name)
+
+        # session types are a bounded SessionType enumeration
+        data['typeOfSession'] = normalizeSessionType(data['typeOfSession'])
 
-        p_key = conference.key
-        # allocate new Session ID with Conference key as parent
-        s_id = Session.allocate_ids(size=1, parent=p_key)[0]
-        # make Session key from ID
-        s_key = ndb.Key(Session, s_id, parent=p_key)
         data['key'] = s_key
-        data['websafeConferenceKey'] = wsck
+        data['websafeConferenceKey'] = s_key.parent().urlsafe()
         del data['sessionSafeKey']
+        return Session(**data)
 
-        # Load all sessions of this conference
-        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))
-        # Filter all the sessions for the specified speaker
-        sessions = sessions.filter(Session.speaker == data['speaker'])
-        # If specified speaker did more than 1 session
-        if sessions.count() > 1:
-            # Create an empty dictionary
-            featured_speaker_data = {}
-            # Add to dictionary speaker key with speaker name
-            featured_speaker_data['speaker'] = data['speaker']
-            # Add to dictionary sessions_names key with empty list
-            featured_speaker_data['sessions_names'] = []
-            # Cycle sessions
-            for session in sessions:
-                # Append session name to sessions_names list
-                featured_speaker_data['sessions_names'].append(session.name)
-            # Pickle data in order to send it to memcache in a single variable
-            featured_speaker_data = pickle.dumps(featured_speaker_data)
-            # Add speaker data to memcache
-            self.addSpeakerToMemCache(featured_speaker_data)
-
-        #  save session into database
-        Session(**data).put()
 
-        return request
+    @instrumentation.method(SessionForms, SessionForms,
+            path='createSessions',
+            http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create up to MAX_SESSION_IMPORT sessions, e.g. a whole agenda,
+        in conferences organized by the user; returns the sessions
+        created. All of them are validated before any is stored."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        if len(request.items) > MAX_SESSION_IMPORT:
+            raise endpoints.BadRequestException(
+                'At most %d sessions can be created at once' % MAX_SESSION_IMPORT)
+        for form in request.items:
+            if not form.name:
+                raise endpoints.BadRequestException("Field 'name' is mandatory")
+
+        # one ID allocation per conference, made while its organizer is checked
+        by_conference = {}
+        for form in request.items:
+            by_conference.setdefault(self._sessionConferenceKey(form), []).append(form)
+        c_keys = by_conference.keys()
+        s_ids = [Session.allocate_ids_async(size=len(by_conference[c_key]),
+                                            parent=c_key)
+                 for c_key in c_keys]
+        self._checkSessionOrganizer(c_keys, user_id)
 
-    #def addSpeakerToMemCache(self, speaker, sessions_names):
-    def addSpeakerToMemCache(self, speaker):
-        """Add Speaker to MemCache; used by
-        createSessionObject.
-        """
-        #taskqueue.add(params={'speaker': speaker, 'sessions': sessions_names},
-        taskqueue.add(params={'speaker': speaker},
-            url='/tasks/store_speaker_in_memcache',
-            method = 'GET'
-        )
+        sessions = []
+        for c_key, ids in zip(c_keys, s_ids):
+            first = ids.get_result()[0]
+            for offset, form in enumerate(by_conference[c_key]):
+                sessions.append(self._sessionFromForm(form,
+                    ndb.Key(Session, first + offset, parent=c_key)))
+
+        for start in range(0, len(sessions), SESSION_PUT_BATCH_SIZE):
+            ndb.put_multi(sessions[start:start + SESSION_PUT_BATCH_SIZE])
+        self._bumpSessionSetVersions(c_keys)
+        # speaker statistics of all the sessions follow in one task
+        wssks = [session.key.urlsafe() for session in sessions if session.speaker]
+        if wssks:
+            taskqueue.add(params={'websafeSessionKey': wssks},
+                url='/tasks/update_speaker_stats')
+
+        return SessionForms(
+            items=[self._copySessionToForm(session) for session in sessions])
 
-    @endpoints.method(SESSION_WISHLIST_POST_REQUEST, SessionForm,
+
+    @ndb.transactional()
+    def _storeSession(self, session):
+        """Put session and enqueue the update of its speaker statistics;
+        the task only runs if the session is stored."""
+        session.put()
+        if session.speaker:
+            taskqueue.add(params={'websafeSessionKey': session.key.urlsafe()},
+                url='/tasks/update_speaker_stats',
+                transactional=True
+            )
+
+    @instrumentation.method(SESSION_WISHLIST_POST_REQUEST, SessionForm,
         path='sessions/addsessiontowishlist',
         http_method='POST', name='addSessionToWishlist')
     def addSessionToWishlist(self, request):
@@ -592,63 +1330,98 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
 
         # raise error if user already has session in wishlist
-        if session.key in prof.sessionKeysWishlist:
+        w_key = ndb.Key(WishlistEntry, request.websafeSessionKey, parent=prof.key)
+        if w_key.get():
             raise endpoints.BadRequestException(
                 'Session already saved to wishlist: %s' % request.websafeSessionKey)
 
-        # append to user's session wishlist
-        prof.sessionKeysWishlist.append(request.websafeSessionKey)
-        prof.put()
+        # add to user's session wishlist
+        WishlistEntry(key=w_key).put()
 
         return self._copySessionToForm(session)
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @instrumentation.method(message_types.VoidMessage, SessionForms,
             path='sessions/wishlist',
             http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """Get list of sessions that user has added to their Wishlist."""
         # get user Profile
         profile = self._getProfileFromUser()
-        session_keys = [ndb.Key(urlsafe=wsck) for wsck in profile.sessionKeysWishlist]
-        sessions = ndb.get_multi(session_keys)
+        w_keys = WishlistEntry.query(ancestor=profile.key).fetch(keys_only=True)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=w_key.id()) for w_key in w_keys])
 
         # return set of Session objects per Wishlist
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session) for session in sessions if session]
         )
 
-    @endpoints.method(SESSION_WISHLIST_DELETE_REQUEST, BooleanMessage,
+    @instrumentation.method(SESSION_WISHLIST_DELETE_REQUEST, BooleanMessage,
             path='sessions/wishlist/delete/{websafeSessionKey}',
             http_method='DELETE', name='deleteSessionInWishlist')
     def deleteSessionInWishlist(self, request):
         """Delete the requested session from user's Wishlist."""
         # get user Profile
         profile = self._getProfileFromUser()
-        for session in profile.sessionKeysWishlist:
-            logging.debug(session)
-            if request.websafeSessionKey == session:
-                profile.sessionKeysWishlist.remove(request.websafeSessionKey)
-                profile.put()
-                return BooleanMessage(data=True)
-        else:
+        w_key = ndb.Key(WishlistEntry, request.websafeSessionKey, parent=profile.key)
+        if not w_key.get():
             return BooleanMessage(data=False)
+        w_key.delete()
+        return BooleanMessage(data=True)
+
+
+    @instrumentation.method(WishlistModifyForm, SessionForms,
+            path='sessions/wishlist/modify',
+            http_method='POST', name='modifyWishlist')
+    def modifyWishlist(self, request):
+        """Add and remove several sessions of user's Wishlist at once;
+        returns the resulting Wishlist."""
+        to_add = set(request.add)
+        to_remove = set(request.remove)
+        if len(to_add) + len(to_remove) > MAX_WISHLIST_CHANGES:
+            raise endpoints.BadRequestException(
+                'At most %d wishlist changes per call.' % MAX_WISHLIST_CHANGES)
+        if to_add & to_remove:
+            raise endpoints.BadRequestException(
+                'Sessions both added and removed: %s' % ', '.join(to_add & to_remove))
+        self._websafeKeys(to_add | to_remove, Session)
+
+        # get user Profile and its current Wishlist
+        profile = self._getProfileFromUser()
+        current = set(w_key.id() for w_key in
+            WishlistEntry.query(ancestor=profile.key).fetch(keys_only=True))
+        to_add -= current
+        to_remove &= current
+
+        # one get_multi both validates added sessions and loads the result
+        wishlist = sorted((current | to_add) - to_remove)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in wishlist])
+        missing = [wssk for wssk, session in zip(wishlist, sessions)
+                   if wssk in to_add and not session]
+        if missing:
+            raise endpoints.NotFoundException(
+                'No Session found with key: %s' % ', '.join(missing))
+
+        # write all the changes at once, puts and deletes in parallel
+        futures = ndb.put_multi_async(
+            [WishlistEntry(id=wssk, parent=profile.key) for wssk in to_add])
+        futures += ndb.delete_multi_async(
+            [ndb.Key(WishlistEntry, wssk, parent=profile.key) for wssk in to_remove])
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
+
+        return SessionForms(
+            items=[self._copySessionToForm(session) for session in sessions if session]
+        )
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
+    @instrumentation.timed('serialization')
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        # field mapping and t-shirt Enum conversion are precompiled in mappers.py
+        return profileToForm(prof)
 
 
     def _getProfileFromUser(self):
@@ -657,11 +1430,17 @@ class ConferenceApi(remote.Service):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
+        return self._getProfileAsync(user).get_result()
 
+
+    @ndb.tasklet
+    def _getProfileAsync(self, user):
+        """Tasklet returning the Profile of user, creating new one if
+        non-existent."""
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = yield entitycache.getAsync(p_key)
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -670,9 +1449,46 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            yield profile.put_async()
+        # move legacy registrations/wishlist into child entities
+        elif profile.conferenceKeysToAttend or profile.sessionKeysWishlist:
+            profile = self._migrateProfile(p_key)
+            yield entitycache.bumpAsync(p_key)
+
+        raise ndb.Return(profile)      # return Profile
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateProfile(p_key):
+        """Move the Profile conferenceKeysToAttend and sessionKeysWishlist
+        lists into Registration and WishlistEntry children; returns the
+        updated Profile."""
+        prof = p_key.get()
+        if not prof:
+            return prof
+        entities = [Registration(id=wsck, parent=p_key)
+                    for wsck in prof.conferenceKeysToAttend]
+        entities += [WishlistEntry(id=wssk, parent=p_key)
+                     for wssk in prof.sessionKeysWishlist]
+        if entities:
+            prof.conferenceKeysToAttend = []
+            prof.sessionKeysWishlist = []
+            ndb.put_multi(entities + [prof])
+        return prof
+
 
-        return profile      # return Profile
+    @staticmethod
+    def _migrateProfiles(cursor=None):
+        """Migrate one batch of Profiles; returns the cursor of the next
+        batch or None when done."""
+        profiles, next_cursor, more = Profile.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        for prof in profiles:
+            if prof.conferenceKeysToAttend or prof.sessionKeysWishlist:
+                ConferenceApi._migrateProfile(prof.key)
+                entitycache.bump(prof.key)
+        return next_cursor if more else None
 
 
     def _doProfile(self, save_request=None):
@@ -682,6 +1498,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            oldDisplayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -692,101 +1509,182 @@ class ConferenceApi(remote.Service):
                         else:
                             setattr(prof, field, val)
             prof.put()
-
-        # return ProfileForm
-        return self._copyProfileToForm(prof)
+            entitycache.bump(prof.key)
+            # fan out the new name to the organizer's conferences
+            if prof.displayName != oldDisplayName:
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_display_name'
+                )
+
+        # return ProfileForm, attended conferences come from Registrations
+        pf = self._copyProfileToForm(prof)
+        pf.conferenceKeysToAttend = [r_key.id() for r_key in
+            Registration.query(ancestor=prof.key).fetch(keys_only=True)]
+        return pf
 
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @instrumentation.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
 
-    @endpoints.method(ProfileMiniForm, ProfileForm,
+    @instrumentation.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id):
+        """Copy the organizer Profile displayName onto all of their
+        Conferences; used by the display name fan-out task.
+        """
+        prof = ndb.Key(Profile, user_id).get()
+        if not prof:
+            return
+        confs = Conference.query(ancestor=prof.key).fetch()
+        displayName = prof.displayName or ''
+        changed = [conf for conf in confs
+                   if conf.organizerDisplayName != displayName]
+        for conf in changed:
+            conf.organizerDisplayName = displayName
+        ndb.put_multi(changed)
+        if changed:
+            # cached queryConferences pages show the organizer name
+            ConferenceApi._bumpConferenceGeneration()
+        entitycache.bumpMulti([conf.key for conf in changed])
+        searchindex.indexConferences(changed)
+
+
+    @staticmethod
+    def _backfillOrganizerDisplayName(cursor=None):
+        """Fill organizerDisplayName on one batch of existing Conferences,
+        with '' when the organizer has no name: projection queries skip
+        entities without the property. Returns the cursor of the next
+        batch or None when done.
+        """
+        confs, next_cursor, more = Conference.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+
+        # one get_multi for all the organizers in this batch
+        p_keys = list(set(conf.key.parent() for conf in confs))
+        names = {}
+        for prof in ndb.get_multi(p_keys):
+            if prof:
+                names[prof.key.id()] = prof.displayName
+
+        changed = []
+        for conf in confs:
+            displayName = names.get(conf.key.parent().id()) or ''
+            if conf.organizerDisplayName != displayName:
+                conf.organizerDisplayName = displayName
+                changed.append(conf)
+        ndb.put_multi(changed)
+        if changed:
+            ConferenceApi._bumpConferenceGeneration()
+        entitycache.bumpMulti([conf.key for conf in changed])
+        searchindex.indexConferences(changed)
+
+        return next_cursor if more else None
+
+
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
+    @ndb.transactional()
+    def _updateProfileRegistration(self, p_key, wsck, reg):
+        """Create or delete the Registration of the Profile to wsck;
+        returns False if there was nothing to change."""
+        r_key = ndb.Key(Registration, wsck, parent=p_key)
+        if reg == bool(r_key.get()):
+            return False
+        if reg:
+            Registration(key=r_key).put()
+        else:
+            r_key.delete()
+        return True
+
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
-        prof = self._getProfileFromUser() # get user Profile
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
 
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
+        # get user Profile, conference and registration all at once
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        p_key = ndb.Key(Profile, getUserId(user))
+        prof = self._getProfileAsync(user)
+        conf = entitycache.getAsync(ndb.Key(urlsafe=wsck))
+        registration = ndb.Key(Registration, wsck, parent=p_key).get_async()
+
+        # check if conf exists given websafeConfKey
+        conf = conf.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        prof = prof.get_result()
 
         # register
+        registered = bool(registration.get_result())
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registered:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # take away one seat from the sharded counter
+            if not counters.reserveSeat(conf):
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            # register user, giving the seat back if that fails
+            try:
+                retval = self._updateProfileRegistration(prof.key, wsck, True)
+            except Exception:
+                counters.releaseSeat(conf.key)
+                raise
+            if not retval:
+                counters.releaseSeat(conf.key)
+                raise ConflictException(
+                    "You have already registered for this conference")
+            self._checkAnnouncementThreshold(conf, 1)
 
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            # the transaction checks the user is registered, the early
+            # get may predate the migration of a legacy Profile
+            retval = self._updateProfileRegistration(prof.key, wsck, False)
+            # add back one seat
+            if retval:
+                counters.releaseSeat(conf.key)
+                self._checkAnnouncementThreshold(conf, -1)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @instrumentation.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        r_keys = Registration.query(ancestor=prof.key).fetch(keys_only=True)
+        # popular conferences come from the entity cache, their version
+        # lookups are batched into one memcache call
+        conferences = [future.get_result() for future in
+            [entitycache.getAsync(ndb.Key(urlsafe=r_key.id())) for r_key in r_keys]]
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        return ConferenceForms(items=[self._copyConferenceToForm(conf)\
+         for conf in conferences if conf]
         )
 
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @instrumentation.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
     def registerForConference(self, request):
@@ -794,7 +1692,7 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @instrumentation.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
     def unregisterFromConference(self, request):
@@ -807,45 +1705,187 @@ class ConferenceApi(remote.Service):
     @staticmethod
     def _cacheAnnouncement():
         """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        memcache cron job, refresh task & getAnnouncement().
         """
         conferences = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= ANNOUNCEMENT_SEATS_THRESHOLD,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
 
         if conferences:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = "Last chance to attend!"
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+            # format announcement with their names
+            announcement = "Last chance to attend! The following " \
+                "conferences are nearly sold out: %s" % \
+                ', '.join(conf.name for conf in conferences)
         else:
             # If there are no sold out conferences,
-            # delete the memcache announcements entry
+            # cache an empty announcement
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, {
+            'announcement': announcement,
+            'refreshAt': time.time() + ANNOUNCEMENT_MAX_AGE,
+        })
 
         return announcement
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @staticmethod
+    def _refreshAnnouncement(websafeConferenceKey=None, throttle=True):
+        """Enqueue a background refresh of the Announcement, first
+        reconciling the seats of websafeConferenceKey if given; when
+        throttled only one refresh is enqueued at a time."""
+        if throttle and not memcache.add(MEMCACHE_ANNOUNCEMENT_REFRESH_KEY, 1,
+                time=60):
+            return
+        params = {}
+        if websafeConferenceKey:
+            params['websafeConferenceKey'] = websafeConferenceKey
+        taskqueue.add(params=params, url='/tasks/refresh_announcement')
+
+
+    def _checkAnnouncementThreshold(self, conf, seats_taken):
+        """Refresh the Announcement when taking (or giving back, when
+        negative) seats_taken seats moved conf across the almost sold
+        out threshold or sold it out."""
+        after = counters.getSeatsAvailable(conf)
+        before = after + seats_taken
+        if (before > ANNOUNCEMENT_SEATS_THRESHOLD) != \
+                (after > ANNOUNCEMENT_SEATS_THRESHOLD) or \
+                (before > 0) != (after > 0):
+            self._refreshAnnouncement(conf.key.urlsafe(), throttle=False)
+
+
+    @instrumentation.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        announcement = self._cacheAnnouncement()
-        return StringMessage(data=announcement)
+        cached = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if cached is None:
+            # cold cache: read through once
+            return StringMessage(data=self._cacheAnnouncement())
+        if cached['refreshAt'] < time.time():
+            # serve the stale announcement while a task refreshes it
+            self._refreshAnnouncement()
+        return StringMessage(data=cached['announcement'])
+
+# - - - Featured speaker - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _formatFeaturedSpeaker(stats):
+        """Return the featured speaker announcement for SpeakerStats."""
+        return 'Featured speaker: %s - Sessions: %s' % (
+            stats.speaker, ', '.join(stats.sessionNames))
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _addSessionsToSpeakerStats(sessions):
+        """Count sessions, all given by one speaker in one conference, in
+        their SpeakerStats; returns the updated SpeakerStats."""
+        st_key = ndb.Key(SpeakerStats, normalizeSpeaker(sessions[0].speaker),
+            parent=sessions[0].key.parent())
+        stats = st_key.get() or SpeakerStats(key=st_key, speaker=sessions[0].speaker)
+        # task retries must not count a session twice
+        new = [session for session in sessions
+               if session.key.urlsafe() not in stats.sessionKeys]
+        if new:
+            stats.sessionKeys.extend(session.key.urlsafe() for session in new)
+            stats.sessionNames.extend(session.name or '' for session in new)
+            stats.sessionCount = len(stats.sessionKeys)
+            stats.put()
+        return stats
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _addSessionsToSpeaker(speaker, sessions):
+        """Add sessions, all given by speaker, to the Speaker index."""
+        sp_key = ndb.Key(Speaker, normalizeSpeaker(speaker))
+        sp = sp_key.get() or Speaker(key=sp_key, name=speaker)
+        wssks = [session.key.urlsafe() for session in sessions]
+        new = [wssk for wssk in wssks if wssk not in sp.sessionKeys]
+        if new:
+            sp.sessionKeys.extend(new)
+            sp.sessionCount = len(sp.sessionKeys)
+            sp.put()
+
 
     @staticmethod
-    def _storeFeaturedSpeakerInMemCache(speaker):
-        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, speaker)
+    def _backfillSpeakers(cursor=None):
+        """Index one batch of existing Sessions by Speaker; returns the
+        cursor of the next batch or None when done."""
+        sessions, next_cursor, more = Session.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        by_speaker = {}
+        for session in sessions:
+            if session.speaker:
+                by_speaker.setdefault(normalizeSpeaker(session.speaker),
+                    []).append(session)
+        for grouped in by_speaker.values():
+            ConferenceApi._addSessionsToSpeaker(grouped[0].speaker, grouped)
+        return next_cursor if more else None
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+
+    @staticmethod
+    def _updateSpeakerStats(websafeSessionKeys):
+        """Update speaker statistics and index for new Sessions and
+        feature again, in each of their conferences, the speaker with
+        most sessions; used by the speaker stats task."""
+        sessions = ndb.get_multi([ndb.Key(urlsafe=wssk)
+                                  for wssk in websafeSessionKeys])
+        by_speaker = {}
+        for session in sessions:
+            if session and session.speaker:
+                by_speaker.setdefault(normalizeSpeaker(session.speaker),
+                    []).append(session)
+
+        c_keys = set()
+        for grouped in by_speaker.values():
+            ConferenceApi._addSessionsToSpeaker(grouped[0].speaker, grouped)
+            by_conference = {}
+            for session in grouped:
+                by_conference.setdefault(session.key.parent(), []).append(session)
+            for c_key, conf_sessions in by_conference.items():
+                ConferenceApi._addSessionsToSpeakerStats(conf_sessions)
+                c_keys.add(c_key)
+        # the speakers of this batch compete with the stored ones
+        futures = [(c_key, ConferenceApi._featuredSpeakerAsync(c_key))
+                   for c_key in c_keys]
+        if futures:
+            memcache.set_multi(dict(
+                (MEMCACHE_FEATURED_SPEAKER_KEY % c_key.urlsafe(),
+                 future.get_result()) for c_key, future in futures))
+
+
+    @staticmethod
+    @ndb.tasklet
+    def _featuredSpeakerAsync(c_key):
+        """Tasklet returning the featured speaker announcement of a
+        conference: its speaker with most sessions, when more than one;
+        "" when there is none."""
+        stats = yield SpeakerStats.query(SpeakerStats.sessionCount > 1,
+            ancestor=c_key).order(-SpeakerStats.sessionCount).get_async()
+        raise ndb.Return(
+            ConferenceApi._formatFeaturedSpeaker(stats) if stats else "")
+
+
+    @instrumentation.method(FEATURED_SPEAKER_GET_REQUEST, StringMessage,
             path='conference/featuredspeaker',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return featured speaker from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+        """Return featured speaker of a conference from memcache."""
+        if not request.websafeConferenceKey:
+            raise endpoints.BadRequestException("websafeConferenceKey is required")
+        c_key = self._websafeKeys([request.websafeConferenceKey], Conference)[0]
+        cache_key = MEMCACHE_FEATURED_SPEAKER_KEY % request.websafeConferenceKey
+        featured = memcache.get(cache_key)
+        if featured is None:
+            # rebuild with the rule of the speaker stats task
+            featured = self._featuredSpeakerAsync(c_key).get_result()
+            memcache.set(cache_key, featured)
+        return StringMessage(data=featured)
 
 
 api = endpoints.api_server([ConferenceApi]) # register API
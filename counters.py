@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""counters.py
+
+Conference Organization sharded seat counters
+
+Every Conference has SEAT_SHARDS root SeatShard entities holding its free
+seats. Registrations take a seat from a random shard in a transaction on
+that shard alone, so they no longer contend on the Conference entity
+group; Conference.seatsAvailable is a view reconciled by a cron job.
+
+Conferences stored before seat sharding get their shards, seeded from
+their seatsAvailable, by the /tasks/backfill_seat_shards task or by the
+first seat counter call on them.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import entitycache
+import searchindex
+from models import Conference
+from models import SeatAdjustment
+from models import SeatShard
+
+SEAT_SHARDS = 20
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+SEATS_CACHE_TIMEOUT = 60
+RECONCILE_BATCH_SIZE = 50
+BACKFILL_BATCH_SIZE = 50
+
+
+def _shardKeys(conf_key):
+    """Return the SeatShard keys of a Conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (wsck, index))
+            for index in range(SEAT_SHARDS)]
+
+
+def _cacheKey(conf_key):
+    return MEMCACHE_SEATS_KEY % conf_key.urlsafe()
+
+
+def _initialSeats(seats, index):
+    """Spread seats over the shards, remainder going to the first ones."""
+    return seats // SEAT_SHARDS + (1 if index < seats % SEAT_SHARDS else 0)
+
+
+@ndb.tasklet
+def createSeatShardsAsync(conf_key, seats):
+    """Tasklet creating the shards of a new Conference holding seats
+    free seats."""
+    yield (ndb.put_multi_async([SeatShard(key=key, seats=_initialSeats(seats, index))
+                                for index, key in enumerate(_shardKeys(conf_key))]),
+           ndb.get_context().memcache_set(_cacheKey(conf_key), seats,
+                                          time=SEATS_CACHE_TIMEOUT))
+
+
+def createSeatShards(conf_key, seats):
+    """Create the shards of a new Conference holding seats free seats."""
+    createSeatShardsAsync(conf_key, seats).get_result()
+
+
+def _initSeatShards(conf):
+    """Create the missing shards of a Conference stored before seat
+    sharding, seeded from its seatsAvailable; existing ones are kept."""
+    seats = conf.seatsAvailable or 0
+    futures = [SeatShard.get_or_insert_async(key.id(),
+                   seats=_initialSeats(seats, index))
+               for index, key in enumerate(_shardKeys(conf.key))]
+    ndb.Future.wait_all(futures)
+
+
+def _ensureSeatShards(conf_key, keys):
+    """Create the shards of a Conference stored before seat sharding
+    when it has none yet; returns True if it had none."""
+    if any(ndb.get_multi(keys)):
+        return False
+    conf = conf_key.get()
+    if conf:
+        _initSeatShards(conf)
+    return True
+
+
+def _adjustmentKey(shard_key, adjustment):
+    return ndb.Key(SeatAdjustment, adjustment, parent=shard_key)
+
+
+@ndb.transactional
+def _takeSeats(shard_key, wanted, adjustment=None):
+    """Take up to wanted seats from one shard; returns the number taken.
+
+    With an adjustment id the seats taken are recorded under the shard,
+    in the same transaction, and the adjustment is never applied twice.
+    """
+    shard = shard_key.get()
+    if not shard or shard.seats <= 0:
+        return 0
+    if adjustment and _adjustmentKey(shard_key, adjustment).get():
+        return 0
+    taken = min(shard.seats, wanted)
+    shard.seats -= taken
+    if adjustment:
+        ndb.put_multi([shard, SeatAdjustment(
+            key=_adjustmentKey(shard_key, adjustment), seats=-taken)])
+    else:
+        shard.put()
+    return taken
+
+
+@ndb.transactional
+def _giveSeats(shard_key, seats, adjustment=None):
+    """Add seats to one shard; with an adjustment id, as _takeSeats."""
+    shard = shard_key.get() or SeatShard(key=shard_key)
+    if adjustment and _adjustmentKey(shard_key, adjustment).get():
+        return
+    shard.seats += seats
+    if adjustment:
+        ndb.put_multi([shard, SeatAdjustment(
+            key=_adjustmentKey(shard_key, adjustment), seats=seats)])
+    else:
+        shard.put()
+
+
+def _sweep(keys, wanted, adjustment=None):
+    """Take up to wanted seats from the shards that still have some,
+    in random order; returns the number taken."""
+    shards = [shard for shard in ndb.get_multi(keys)
+              if shard and shard.seats > 0]
+    random.shuffle(shards)
+    taken = 0
+    for shard in shards:
+        if taken == wanted:
+            break
+        taken += _takeSeats(shard.key, wanted - taken, adjustment)
+    return taken
+
+
+def reserveSeat(conf):
+    """Take one seat of a Conference; returns False when sold out.
+
+    A random shard is tried first; when it is empty the remaining shards
+    are swept. Each decrement is checked inside its shard transaction, so
+    seats can never be oversold.
+    """
+    keys = _shardKeys(conf.key)
+    taken = _takeSeats(random.choice(keys), 1) or _sweep(keys, 1)
+    if not taken and _ensureSeatShards(conf.key, keys):
+        taken = _sweep(keys, 1)
+    if taken:
+        memcache.decr(_cacheKey(conf.key))
+    return bool(taken)
+
+
+def releaseSeat(conf_key):
+    """Give one seat of a Conference back to a random shard."""
+    keys = _shardKeys(conf_key)
+    # a lone new shard would hide the seats of a conference stored
+    # before seat sharding
+    _ensureSeatShards(conf_key, keys)
+    _giveSeats(random.choice(keys), 1)
+    memcache.incr(_cacheKey(conf_key))
+
+
+def adjustSeats(conf_key, delta, adjustment=None):
+    """Add (or remove, when negative) delta seats, e.g. after a change
+    of maxAttendees; seats already taken are never removed.
+
+    adjustment (the task name) makes a retry apply only what is left of
+    delta: every shard records the seats it moved for it.
+    """
+    keys = _shardKeys(conf_key)
+    if not any(ndb.get_multi(keys)):
+        # conference stored before seat sharding: its seatsAvailable,
+        # which the shards are seeded from, already counts delta. The
+        # adjustment is recorded first, so a retry never applies it.
+        if adjustment:
+            SeatAdjustment(key=_adjustmentKey(keys[0], adjustment),
+                           seats=delta).put()
+        _ensureSeatShards(conf_key, keys)
+        memcache.delete(_cacheKey(conf_key))
+        return
+    if adjustment:
+        done = ndb.get_multi([_adjustmentKey(key, adjustment) for key in keys])
+        delta -= sum(a.seats for a in done if a)
+        keys = [key for key, a in zip(keys, done) if not a]
+    if delta > 0:
+        _giveSeats(random.choice(keys), delta, adjustment)
+    elif delta < 0:
+        _sweep(keys, -delta, adjustment)
+    memcache.delete(_cacheKey(conf_key))
+
+
+@ndb.tasklet
+def getSeatsAvailableAsync(conf_key):
+    """Tasklet returning the free seats of a Conference, summing its
+    shards through memcache; None when it has no shards yet."""
+    ctx = ndb.get_context()
+    cache_key = _cacheKey(conf_key)
+    seats = yield ctx.memcache_get(cache_key)
+    if seats is None:
+        shards = yield ndb.get_multi_async(_shardKeys(conf_key))
+        if not any(shards):
+            raise ndb.Return(None)
+        seats = sum(shard.seats for shard in shards if shard)
+        yield ctx.memcache_add(cache_key, seats, time=SEATS_CACHE_TIMEOUT)
+    raise ndb.Return(seats)
+
+
+def getSeatsAvailable(conf):
+    """Return the free seats of a Conference, summing its shards through
+    memcache."""
+    seats = getSeatsAvailableAsync(conf.key).get_result()
+    return conf.seatsAvailable or 0 if seats is None else seats
+
+
+@ndb.transactional
+def _setSeatsView(conf_key, seats):
+    """Store seats as the seatsAvailable view of a Conference."""
+    conf = conf_key.get()
+    if conf and conf.seatsAvailable != seats:
+        conf.seatsAvailable = seats
+        conf.put()
+        return True
+    return False
+
+
+def reconcileConference(conf_key):
+    """Copy the shard total of one Conference onto its seatsAvailable
+    view; returns True if the view changed."""
+    shards = ndb.get_multi(_shardKeys(conf_key))
+    if not any(shards):
+        return False
+    seats = sum(shard.seats for shard in shards if shard)
+    memcache.set(_cacheKey(conf_key), seats, time=SEATS_CACHE_TIMEOUT)
+    if _setSeatsView(conf_key, seats):
+        entitycache.bump(conf_key)
+        searchindex.indexConference(conf_key.urlsafe())
+        return True
+    return False
+
+
+def reconcileSeats(cursor=None):
+    """Copy the shard totals of one batch of Conferences onto their
+    seatsAvailable view; returns (next cursor or None, number changed)."""
+    confs, next_cursor, more = Conference.query().fetch_page(
+        RECONCILE_BATCH_SIZE, start_cursor=cursor)
+
+    # one get_multi for the shards of the whole batch
+    keys = [key for conf in confs for key in _shardKeys(conf.key)]
+    shards = ndb.get_multi(keys)
+
+    changed = []
+    for index, conf in enumerate(confs):
+        mine = shards[index * SEAT_SHARDS:(index + 1) * SEAT_SHARDS]
+        if not any(mine):
+            continue
+        seats = sum(shard.seats for shard in mine if shard)
+        memcache.set(_cacheKey(conf.key), seats, time=SEATS_CACHE_TIMEOUT)
+        if conf.seatsAvailable != seats and _setSeatsView(conf.key, seats):
+            entitycache.bump(conf.key)
+            changed.append(conf.key)
+
+    # search documents are rewritten from the committed conferences
+    searchindex.indexConferences([conf for conf in ndb.get_multi(changed) if conf])
+    return (next_cursor if more else None), len(changed)
+
+
+def backfillSeatShards(cursor=None):
+    """Create the shards of the Conferences of one batch that were stored
+    before seat sharding; returns the cursor of the next batch or None
+    when done."""
+    confs, next_cursor, more = Conference.query().fetch_page(
+        BACKFILL_BATCH_SIZE, start_cursor=cursor)
+
+    # one get_multi for the shards of the whole batch
+    keys = [key for conf in confs for key in _shardKeys(conf.key)]
+    shards = ndb.get_multi(keys)
+    for index, conf in enumerate(confs):
+        if not any(shards[index * SEAT_SHARDS:(index + 1) * SEAT_SHARDS]):
+            _initSeatShards(conf)
+    return next_cursor if more else None
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""entitycache.py
+
+Conference Organization per-instance entity cache
+
+Hot Profiles and Conferences are kept in a size-bounded LRU in the
+instance memory, shared by the request threads, in front of ndb. Every
+cached entity carries the version number it was read at; versions live
+in memcache and are bumped (bump/bumpAsync) after every put of the
+entity, so a read only costs a memcache get of the version when the
+entity is cached and current. The version is read before the entity, so
+a put racing with a read can only leave an already stale copy behind.
+Reads inside a transaction always go to the datastore. Versions only
+ever grow, so they also serve as ETags of the entities, and keys of no
+entity (e.g. the session set of a Conference) are versioned the same way
+to invalidate whatever is derived from them.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import collections
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import instrumentation
+
+MAX_ENTITIES = 1000
+TTL = 300
+MEMCACHE_VERSION_KEY = "ENTITY_VERSION:%s"
+
+
+class LRUCache(object):
+    """Thread-safe LRU of (entity protobuf, version) with a TTL."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0,
+                         'evictions': 0}
+
+    def get(self, key, version):
+        """Return the protobuf cached for key at version, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            pb, cached_version, expires = entry
+            if cached_version != version:
+                self.counters['stale'] += 1
+                return None
+            if expires < time.time():
+                self.counters['expired'] += 1
+                return None
+            # most recently used last
+            self._entries[key] = entry
+            self.counters['hits'] += 1
+            return pb
+
+    def put(self, key, pb, version):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (pb, version, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, size=len(self._entries),
+                         maxSize=self.max_size, ttl=self.ttl)
+        lookups = stats['hits'] + stats['misses'] + stats['stale'] + \
+            stats['expired']
+        stats['hitRate'] = stats['hits'] / float(lookups) if lookups else None
+        return stats
+
+
+_cache = LRUCache(MAX_ENTITIES, TTL)
+_adapter = ndb.ModelAdapter()
+
+
+def _versionKey(key):
+    return MEMCACHE_VERSION_KEY % key.urlsafe()
+
+
+def _initialVersion():
+    # seeded with the clock so an evicted version never goes back to
+    # one that older cached copies were read at
+    return int(time.time() * 1000)
+
+
+@ndb.tasklet
+def versionAsync(key):
+    """Tasklet returning the current version of key from memcache; it
+    only ever grows, so it also serves as the ETag of the entity."""
+    ctx = ndb.get_context()
+    version = yield ctx.memcache_get(_versionKey(key))
+    if version is None:
+        yield ctx.memcache_add(_versionKey(key), _initialVersion())
+        version = yield ctx.memcache_get(_versionKey(key))
+    raise ndb.Return(version)
+
+
+@ndb.tasklet
+def getAsync(key, version=None):
+    """Tasklet returning the entity of key, from this instance's cache
+    when it holds the current version; None if there is no entity.
+
+    Every call returns a new copy, so callers may modify it. version,
+    when the caller already read it with versionAsync, saves reading it
+    again.
+    """
+    if ndb.in_transaction():
+        entity = yield key.get_async()
+        raise ndb.Return(entity)
+    if version is None:
+        version = yield versionAsync(key)
+    pb = _cache.get(key, version) if version is not None else None
+    if pb is not None:
+        instrumentation.count('entity_cache_hits')
+        raise ndb.Return(_adapter.pb_to_entity(pb))
+    instrumentation.count('entity_cache_misses')
+    entity = yield key.get_async()
+    # without a version in memcache there is nothing to invalidate with
+    if entity is not None and version is not None:
+        _cache.put(key, _adapter.entity_to_pb(entity), version)
+    raise ndb.Return(entity)
+
+
+def get(key):
+    """Return the entity of key, see getAsync."""
+    return getAsync(key).get_result()
+
+
+@ndb.tasklet
+def bumpAsync(key):
+    """Tasklet invalidating the cached copies of key on all instances;
+    call it once the put of the entity has committed."""
+    _cache.evict(key)
+    yield ndb.get_context().memcache_incr(_versionKey(key),
+        initial_value=_initialVersion())
+
+
+def bump(key):
+    """Invalidate the cached copies of key on all instances, see bumpAsync."""
+    bumpAsync(key).get_result()
+
+
+def bumpMulti(keys):
+    """Invalidate the cached copies of all keys on all instances."""
+    for key in keys:
+        _cache.evict(key)
+    if keys:
+        memcache.offset_multi(dict((_versionKey(key), 1) for key in keys),
+            initial_value=_initialVersion())
+
+
+def stats():
+    """Return the hit/miss counters and size of this instance's cache."""
+    return _cache.stats()
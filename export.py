@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Conference Organization NDJSON export of conferences, sessions and
+registrations
+
+An export walks every kind of kinds in turn with a query cursor,
+EXPORT_BATCH_SIZE entities per task: each task writes one chunk, a
+newline delimited JSON object per entity, and chains the task of the
+next chunk. Memory per task is bounded by the batch, whatever the size
+of the dataset.
+
+The ExportJob entity is the checkpoint: the kind and cursor the next
+chunk starts at. It is advanced in the transaction that enqueues the
+next task, so a retried or duplicated task finds the checkpoint moved on
+and does nothing, and an interrupted export resumes from its checkpoint
+(resume). The last task writes a manifest listing the chunks.
+
+Chunks are write-once objects named <export id>/<kind>-<chunk>.ndjson,
+as in a Cloud Storage bucket; LocalFileStore keeps them as files under
+EXPORT_DIR, which must be writable (it is not on the python27 runtime of
+App Engine, whose file system is read-only): start and resume check it,
+so a misconfigured export fails at once instead of in its task chain.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import json
+import logging
+import os
+import tempfile
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ExportJob
+from models import Registration
+from models import Session
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_URL = '/tasks/export'
+EXPORT_DIR = os.environ.get('EXPORT_DIR') or \
+    os.path.join(tempfile.gettempdir(), 'conference-export')
+MANIFEST = 'manifest.json'
+RECENT_JOBS = 20
+
+# exported kinds, in export order
+MODELS = {
+    'Conference': Conference,
+    'Session': Session,
+    'Registration': Registration,
+}
+EXPORT_KINDS = ('Conference', 'Session', 'Registration')
+
+
+class StoreError(Exception):
+    """The export store cannot be written."""
+
+
+class LocalFileStore(object):
+    """Stand-in for a Cloud Storage bucket keeping objects as files
+    under root."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def check(self):
+        """Raise StoreError unless objects can be written under root."""
+        probe = os.path.join(self.root, '.probe')
+        try:
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            with open(probe, 'w') as f:
+                f.write('')
+            os.remove(probe)
+        except (IOError, OSError) as e:
+            raise StoreError('Cannot write exports to %s: %s' % (self.root, e))
+
+    def write(self, name, chunks):
+        """Write the object name from an iterable of strings, replacing
+        it at once when it exists."""
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'w') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(path + '.tmp', path)
+
+
+def _store():
+    return LocalFileStore(EXPORT_DIR)
+
+
+def _jsonDefault(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def entityRow(entity):
+    """Return the NDJSON line of an entity: its websafe key, id, websafe
+    parent key and properties."""
+    row = entity.to_dict()
+    row['key'] = entity.key.urlsafe()
+    row['id'] = entity.key.id()
+    if entity.key.parent():
+        row['parent'] = entity.key.parent().urlsafe()
+    return json.dumps(row, default=_jsonDefault, sort_keys=True) + '\n'
+
+
+def chunkName(export_id, kind, chunk):
+    return '%s/%s-%05d.ndjson' % (export_id, kind.lower(), chunk)
+
+
+def _enqueue(job, transactional=False):
+    """Enqueue the task of the chunk at the checkpoint of job."""
+    taskqueue.add(url=EXPORT_URL, params={'exportId': job.key.id(),
+        'kindIndex': job.kindIndex, 'chunk': job.chunk},
+        transactional=transactional)
+
+
+def _atCheckpoint(job, kind_index, chunk):
+    return job is not None and job.status == 'running' and \
+        job.kindIndex == kind_index and job.chunk == chunk
+
+
+def start(kinds=EXPORT_KINDS):
+    """Start an export of kinds; returns its ExportJob. Raises
+    ValueError for a kind that cannot be exported and StoreError when
+    EXPORT_DIR cannot be written."""
+    kinds = list(kinds)
+    if not kinds:
+        raise ValueError('No kinds to export')
+    unknown = [kind for kind in kinds if kind not in MODELS]
+    if unknown:
+        raise ValueError('Cannot export kinds: %s' % ', '.join(unknown))
+    _store().check()
+    export_id = datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')
+
+    @ndb.transactional
+    def create():
+        job = ExportJob(id=export_id, kinds=kinds, rows=[0] * len(kinds),
+                        chunks=[0] * len(kinds))
+        job.put()
+        _enqueue(job, transactional=True)
+        return job
+    return create()
+
+
+def resume(export_id):
+    """Enqueue again the task of the checkpoint of an unfinished export,
+    e.g. after its task was purged; returns its ExportJob or None.
+    Raises StoreError when EXPORT_DIR cannot be written."""
+    job = ndb.Key(ExportJob, export_id).get()
+    if job and job.status == 'running':
+        _store().check()
+        _enqueue(job)
+    return job
+
+
+def _manifest(job, kind_index, rows, written):
+    """Return the manifest of job once the chunk being exported, of rows
+    entities, is counted."""
+    kinds = []
+    for index, kind in enumerate(job.kinds):
+        chunks = job.chunks[index] + (1 if index == kind_index and written else 0)
+        kinds.append({
+            'kind': kind,
+            'rows': job.rows[index] + (rows if index == kind_index else 0),
+            'files': [chunkName(job.key.id(), kind, chunk)
+                      for chunk in range(chunks)],
+        })
+    return json.dumps({'exportId': job.key.id(),
+                       'created': job.created.isoformat(),
+                       'kinds': kinds}, indent=2, sort_keys=True)
+
+
+@ndb.transactional
+def _advance(export_id, kind_index, chunk, rows, written, next_cursor):
+    """Move the checkpoint past the chunk just exported and enqueue the
+    task of the next one; returns False when another task did first."""
+    job = ndb.Key(ExportJob, export_id).get()
+    if not _atCheckpoint(job, kind_index, chunk):
+        return False
+    job.rows[kind_index] += rows
+    if written:
+        job.chunks[kind_index] += 1
+    if next_cursor:
+        job.cursor = next_cursor.urlsafe()
+        job.chunk += 1
+    elif kind_index + 1 < len(job.kinds):
+        job.kindIndex += 1
+        job.cursor = None
+        job.chunk = 0
+    else:
+        job.status = 'done'
+    job.put()
+    if job.status == 'running':
+        _enqueue(job, transactional=True)
+    return True
+
+
+def runChunk(export_id, kind_index, chunk):
+    """Export the chunk at the checkpoint of an export and chain the
+    task of the next one; a task that is not at the checkpoint (a retry
+    of a chunk already done or a duplicate) does nothing."""
+    job = ndb.Key(ExportJob, export_id).get()
+    if not _atCheckpoint(job, kind_index, chunk):
+        logging.info('Export %s: chunk %d of kind %d already done',
+                     export_id, chunk, kind_index)
+        return
+    kind = job.kinds[kind_index]
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = MODELS[kind].query().fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=cursor)
+    next_cursor = next_cursor if more else None
+
+    store = _store()
+    # a retry rewrites the same chunk from the same cursor
+    written = bool(entities)
+    if written:
+        store.write(chunkName(export_id, kind, chunk),
+                    (entityRow(entity) for entity in entities))
+    if not next_cursor and kind_index + 1 == len(job.kinds):
+        store.write('%s/%s' % (export_id, MANIFEST),
+                    [_manifest(job, kind_index, len(entities), written)])
+    _advance(export_id, kind_index, chunk, len(entities), written, next_cursor)
+
+
+def jobStatus(job):
+    """Return the checkpoint of an ExportJob as a JSON-able dict."""
+    return {
+        'exportId': job.key.id(),
+        'status': job.status,
+        'kind': job.kinds[job.kindIndex] if job.status == 'running' else None,
+        'chunk': job.chunk,
+        'rows': dict(zip(job.kinds, job.rows)),
+        'chunks': dict(zip(job.kinds, job.chunks)),
+        'created': job.created.isoformat(),
+        'updated': job.updated.isoformat(),
+        'location': os.path.join(EXPORT_DIR, job.key.id()),
+    }
+
+
+def recentJobs():
+    """Return the RECENT_JOBS most recent ExportJobs."""
+    return ExportJob.query().order(-ExportJob.created).fetch(RECENT_JOBS)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""instrumentation.py
+
+Conference Organization per-endpoint RPC and latency instrumentation
+
+Endpoint methods declared with instrumentation.method instead of
+endpoints.method record their latency, RPC counts and time by App Engine
+service, entities read, time spent in timed() sections (serialization,
+auth) and the counters added with count() (entity cache hits). Records
+are aggregated per instance and flushed to memcache counters every
+FLUSH_INTERVAL seconds; readStats() returns the totals.
+
+Setting PROFILE_SAMPLE_RATE in settings.py turns on the sampled profiler:
+sampled calls run under cProfile and the stats of the ones slower than
+PROFILE_SLOW_MS are logged and kept in memcache.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import cProfile
+import functools
+import logging
+import pstats
+import random
+import StringIO
+import threading
+import time
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+import settings
+
+FLUSH_INTERVAL = 60
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+MEMCACHE_STATS_KEY = "STATS:%s:%s"
+MEMCACHE_PROFILE_KEY = "STATS_PROFILE:%s"
+
+_current = threading.local()
+_lock = threading.Lock()
+_pending = {}
+_lastFlush = [time.time()]
+
+
+def _record():
+    """Return the record of the call running on this thread, or None."""
+    return getattr(_current, 'record', None)
+
+
+def _bucket(latency_ms):
+    """Return the name of the latency histogram bucket for latency_ms."""
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return 'latency_le_%dms' % bound
+    return 'latency_gt_%dms' % LATENCY_BUCKETS_MS[-1]
+
+
+def _preCallHook(service, call, request, response, rpc):
+    record = _record()
+    if record is not None:
+        record['rpcStart'][id(rpc)] = time.time()
+
+
+def _postCallHook(service, call, request, response, rpc):
+    record = _record()
+    if record is None:
+        return
+    counters = record['counters']
+    counters['rpc_%s' % service] = counters.get('rpc_%s' % service, 0) + 1
+    start = record['rpcStart'].pop(id(rpc), None)
+    if start is not None:
+        name = 'rpc_ms_%s' % service
+        counters[name] = counters.get(name, 0) + \
+            int((time.time() - start) * 1000)
+    if service == 'datastore_v3':
+        # entities returned by gets and query batches
+        try:
+            if call == 'Get':
+                read = response.entity_size()
+            elif call in ('RunQuery', 'Next'):
+                read = response.result_size()
+            else:
+                read = 0
+        except AttributeError:
+            read = 0
+        counters['entities_read'] = counters.get('entities_read', 0) + read
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'instrumentation', _preCallHook)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _postCallHook)
+
+
+def timed(section):
+    """Decorator adding the time spent in the decorated function to the
+    section_ms counter of the running call (e.g. serialization, auth)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = _record()
+            if record is None:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                name = '%s_ms' % section
+                record['counters'][name] = record['counters'].get(name, 0) + \
+                    int((time.time() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+def count(counter, value=1):
+    """Add value to counter of the running call, if any (e.g. cache hits)."""
+    record = _record()
+    if record is not None:
+        record['counters'][counter] = record['counters'].get(counter, 0) + value
+
+
+def _aggregate(name, counters):
+    """Add the counters of one call to the pending totals of name."""
+    with _lock:
+        totals = _pending.setdefault(name, {})
+        for counter, value in counters.items():
+            totals[counter] = totals.get(counter, 0) + value
+
+
+def flush(force=False):
+    """Move the pending totals of this instance to the memcache
+    counters, at most every FLUSH_INTERVAL seconds unless forced."""
+    with _lock:
+        if not _pending or \
+                (not force and time.time() - _lastFlush[0] < FLUSH_INTERVAL):
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _lastFlush[0] = time.time()
+    offsets = {}
+    for name, totals in pending.items():
+        for counter, value in totals.items():
+            offsets[MEMCACHE_STATS_KEY % (name, counter)] = value
+    memcache.offset_multi(offsets, initial_value=0)
+
+
+def _profile(name, func, args, kwargs, record):
+    """Run func under cProfile, keeping the stats if it was slow."""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        latency_ms = (time.time() - record['start']) * 1000
+        if latency_ms >= settings.PROFILE_SLOW_MS:
+            out = StringIO.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(
+                'cumulative').print_stats(30)
+            logging.info('Slow %s call (%d ms) profile:\n%s',
+                         name, latency_ms, out.getvalue())
+            memcache.set(MEMCACHE_PROFILE_KEY % name, out.getvalue())
+
+
+def instrument(func):
+    """Decorator recording stats for every call of an endpoint method."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _record() is not None:
+            # nested endpoint call, counted by the outer one
+            return func(*args, **kwargs)
+        record = _current.record = {'start': time.time(), 'counters': {},
+                                    'rpcStart': {}}
+        try:
+            if settings.PROFILE_SAMPLE_RATE and \
+                    random.random() < settings.PROFILE_SAMPLE_RATE:
+                return _profile(name, func, args, kwargs, record)
+            return func(*args, **kwargs)
+        finally:
+            _current.record = None
+            latency_ms = int((time.time() - record['start']) * 1000)
+            counters = record['counters']
+            counters['calls'] = 1
+            counters['latency_ms'] = latency_ms
+            counters[_bucket(latency_ms)] = 1
+            _aggregate(name, counters)
+            try:
+                flush()
+            except Exception:
+                logging.exception('Could not flush endpoint stats')
+    return wrapper
+
+
+def method(*args, **kwargs):
+    """endpoints.method that also instruments the decorated method."""
+    endpoints_decorator = endpoints.method(*args, **kwargs)
+
+    def decorator(func):
+        return endpoints_decorator(instrument(func))
+    return decorator
+
+
+def readStats(names):
+    """Return the flushed stats of the endpoint methods in names as
+    {name: {counter: value}}, adding the average latency and the last
+    slow call profile."""
+    counters = ['calls', 'latency_ms', 'entities_read', 'serialization_ms',
+                'auth_ms', 'entity_cache_hits', 'entity_cache_misses']
+    counters += [_bucket(bound) for bound in LATENCY_BUCKETS_MS]
+    counters.append(_bucket(LATENCY_BUCKETS_MS[-1] + 1))
+    for service in ('datastore_v3', 'memcache', 'taskqueue', 'search',
+                    'urlfetch', 'mail'):
+        counters += ['rpc_%s' % service, 'rpc_ms_%s' % service]
+
+    keys = [MEMCACHE_STATS_KEY % (name, counter)
+            for name in names for counter in counters]
+    keys += [MEMCACHE_PROFILE_KEY % name for name in names]
+    values = memcache.get_multi(keys)
+    stats = {}
+    for name in names:
+        method_stats = {}
+        for counter in counters:
+            value = values.get(MEMCACHE_STATS_KEY % (name, counter))
+            if value:
+                method_stats[counter] = value
+        if method_stats.get('calls'):
+            method_stats['avg_latency_ms'] = \
+                method_stats.get('latency_ms', 0) / float(method_stats['calls'])
+            stats[name] = method_stats
+        profile = values.get(MEMCACHE_PROFILE_KEY % name)
+        if profile:
+            stats.setdefault(name, {})['slowProfile'] = profile
+    return stats
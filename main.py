@@ -8,10 +8,23 @@ Conference Organization server-side Python App Engine
 
 __author__ = 'd.nastri@gmail.com (Davide Nastri)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+from conference import MEMCACHE_ANNOUNCEMENT_REFRESH_KEY
+import counters
+import entitycache
+import export
+import instrumentation
+import notifications
+import searchindex
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -20,9 +33,22 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class RefreshAnnouncementHandler(webapp2.RequestHandler):
+    def post(self):
+        """Reconcile the seats of a Conference if given, then refresh
+        the Announcement in Memcache."""
+        wsck = self.request.get('websafeConferenceKey')
+        if wsck and counters.reconcileConference(ndb.Key(urlsafe=wsck)):
+            ConferenceApi._bumpConferenceGeneration()
+        ConferenceApi._cacheAnnouncement()
+        memcache.delete(MEMCACHE_ANNOUNCEMENT_REFRESH_KEY)
+        self.response.set_status(204)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation; only drains the
+        push tasks queued before emails were batched."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -33,14 +59,222 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
-class StoreSpeakerInMemCacheHandler(webapp2.RequestHandler):
-      def get(self):
-        """Stores Speaker in Memcache."""
-        ConferenceApi._storeFeaturedSpeakerInMemCache(self.request.get('speaker'))
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send the queued confirmation emails; run by cron."""
+        self.post()
+
+    def post(self):
+        """Send the queued confirmation emails in batches."""
+        counts = notifications.sendConfirmationEmails()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(counts, sort_keys=True))
+
+class RequeueConfirmationEmailsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Give the dead lettered confirmation emails a new series of
+        attempts."""
+        moved = notifications.requeueDeadLetters()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'requeued': moved}))
+
+class UpdateSpeakerStatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update speaker statistics of new Sessions."""
+        ConferenceApi._updateSpeakerStats(
+            self.request.get_all('websafeSessionKey'))
         self.response.set_status(204)
 
+class UpdateOrganizerDisplayNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer displayName onto their Conferences."""
+        ConferenceApi._updateOrganizerDisplayName(self.request.get('userId'))
+        self.response.set_status(204)
+
+
+class BatchTaskHandler(webapp2.RequestHandler):
+    """Walk a query in cursor batches, one chained task per batch;
+    subclasses implement runBatch(cursor) returning the next cursor."""
+
+    def get(self):
+        """Start the batch task chain."""
+        taskqueue.add(url=self.request.path)
+        self.response.set_status(202)
+
+    def post(self):
+        """Process one batch and chain a task for the next one."""
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        next_cursor = self.runBatch(cursor)
+        if next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url=self.request.path
+            )
+        self.response.set_status(204)
+
+
+class BackfillOrganizerDisplayNameHandler(BatchTaskHandler):
+    def runBatch(self, cursor):
+        """Backfill organizerDisplayName on one batch of Conferences."""
+        return ConferenceApi._backfillOrganizerDisplayName(cursor)
+
+
+class MigrateProfilesHandler(BatchTaskHandler):
+    def runBatch(self, cursor):
+        """Move Profile lists into Registration/WishlistEntry."""
+        return ConferenceApi._migrateProfiles(cursor)
+
+
+class BackfillSpeakersHandler(BatchTaskHandler):
+    def runBatch(self, cursor):
+        """Index one batch of existing Sessions by Speaker."""
+        return ConferenceApi._backfillSpeakers(cursor)
+
+
+class BackfillSessionIndexHandler(BatchTaskHandler):
+    def runBatch(self, cursor):
+        """Normalize session types and store startMinutes."""
+        return ConferenceApi._backfillSessionIndex(cursor)
+
+
+class BackfillSeatShardsHandler(BatchTaskHandler):
+    def runBatch(self, cursor):
+        """Create the seat shards of Conferences stored before them."""
+        return counters.backfillSeatShards(cursor)
+
+
+class BackfillSearchIndexHandler(BatchTaskHandler):
+    def runBatch(self, cursor):
+        """Write the search documents of one batch of Conferences."""
+        return searchindex.backfill(cursor)
+
+
+class IndexConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rewrite the search document of a Conference."""
+        searchindex.indexConference(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class AdjustSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply a change of maxAttendees to the seat counters, once
+        whatever the retries of the task."""
+        counters.adjustSeats(
+            ndb.Key(urlsafe=self.request.get('websafeConferenceKey')),
+            int(self.request.get('delta')),
+            self.request.headers.get('X-AppEngine-TaskName'))
+        self.response.set_status(204)
+
+
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start reconciling Conference seatsAvailable with the counters."""
+        self.post()
+
+    def post(self):
+        """Reconcile one batch and chain a task for the next one."""
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        next_cursor, changed = counters.reconcileSeats(cursor)
+        if changed:
+            ConferenceApi._bumpConferenceGeneration()
+        if next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                url='/crons/reconcile_seats'
+            )
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the checkpoint of the export exportId, or of the most
+        recent ones, as JSON."""
+        export_id = self.request.get('exportId')
+        if export_id:
+            job = ndb.Key(export.ExportJob, export_id).get()
+            if not job:
+                self.abort(404)
+            status = export.jobStatus(job)
+        else:
+            status = [export.jobStatus(job) for job in export.recentJobs()]
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(status, indent=2, sort_keys=True))
+
+    def post(self):
+        """Start an export of the kinds parameters (all by default), or
+        resume the export exportId from its checkpoint."""
+        export_id = self.request.get('exportId')
+        try:
+            if export_id:
+                job = export.resume(export_id)
+                if not job:
+                    self.abort(404)
+            else:
+                job = export.start(self.request.get_all('kinds') or
+                                   export.EXPORT_KINDS)
+        except ValueError as e:
+            self.abort(400, detail=str(e))
+        except export.StoreError as e:
+            self.abort(503, detail=str(e))
+        self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(export.jobStatus(job), indent=2,
+                                       sort_keys=True))
+
+
+class ExportTaskHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export one chunk and chain a task for the next one."""
+        export.runChunk(self.request.get('exportId'),
+                        int(self.request.get('kindIndex')),
+                        int(self.request.get('chunk')))
+        self.response.set_status(204)
+
+
+class QueryCacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return queryConferences cache hit/miss counters as JSON."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(ConferenceApi._queryCacheStats()))
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return per-endpoint latency, RPC and serialization stats as JSON."""
+        instrumentation.flush(force=True)
+        names = sorted(ConferenceApi.all_remote_methods())
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrumentation.readStats(names),
+                                       indent=2, sort_keys=True))
+
+class EntityCacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the entity cache stats of this instance as JSON; the
+        hits and misses of every endpoint are in the endpoint stats."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(entitycache.stats(), sort_keys=True))
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/tasks/refresh_announcement', RefreshAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/store_speaker_in_memcache', StoreSpeakerInMemCacheHandler),
+    ('/tasks/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/admin/requeue_confirmation_emails', RequeueConfirmationEmailsHandler),
+    ('/tasks/update_speaker_stats', UpdateSpeakerStatsHandler),
+    ('/tasks/update_organizer_display_name', UpdateOrganizerDisplayNameHandler),
+    ('/tasks/backfill_organizer_display_name', BackfillOrganizerDisplayNameHandler),
+    ('/tasks/adjust_seats', AdjustSeatsHandler),
+    ('/tasks/migrate_profiles', MigrateProfilesHandler),
+    ('/tasks/backfill_speakers', BackfillSpeakersHandler),
+    ('/tasks/backfill_session_index', BackfillSessionIndexHandler),
+    ('/tasks/backfill_search_index', BackfillSearchIndexHandler),
+    ('/tasks/backfill_seat_shards', BackfillSeatShardsHandler),
+    ('/tasks/index_conference', IndexConferenceHandler),
+    ('/crons/reconcile_seats', ReconcileSeatsHandler),
+    ('/admin/export', ExportHandler),
+    ('/tasks/export', ExportTaskHandler),
+    ('/admin/stats/query_cache', QueryCacheStatsHandler),
+    ('/admin/stats/endpoints', EndpointStatsHandler),
+    ('/admin/stats/entity_cache', EntityCacheStatsHandler),
 ], debug=True)
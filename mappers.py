@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""mappers.py
+
+Conference Organization precompiled ndb entity -> ProtoRPC message mappers
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+from operator import attrgetter
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceSummaryForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+
+
+def _urlsafeKey(entity):
+    """Return the websafe key string of entity."""
+    return entity.key.urlsafe()
+
+
+def _converterFor(prop, field):
+    """Return the value conversion for a property/field pair, or None
+    when the value can be copied as is."""
+    # Date and Time are sent as strings (DateTimeProperty is their base)
+    if isinstance(prop, ndb.DateTimeProperty):
+        return str
+    # Enums are stored by name
+    if isinstance(field, messages.EnumField):
+        return field.type.lookup_by_name
+    return None
+
+
+def compileMapper(model, message, computed=None, fields=None):
+    """Build a function copying a model entity into a new message.
+
+    Matching fields and their conversions are resolved once here, so the
+    returned function does no field introspection per entity. computed
+    maps message field names to functions of the entity for fields that
+    have no model property (e.g. websafe keys). When fields is given only
+    those properties are copied, e.g. the ones of a projection query.
+    """
+    computed = computed or {}
+    plan = []
+    for field in message.all_fields():
+        if field.name in computed:
+            plan.append((field.name, computed[field.name], None, False))
+            continue
+        if fields is not None and field.name not in fields:
+            continue
+        prop = model._properties.get(field.name)
+        if prop is None:
+            continue
+        # Date/Time properties are always stringified, None included,
+        # to keep the output of the former reflective copy loops
+        always = isinstance(prop, ndb.DateTimeProperty)
+        plan.append((field.name, attrgetter(field.name),
+                     _converterFor(prop, field), always))
+    plan = tuple(plan)
+
+    def copy(entity):
+        values = {}
+        for name, getter, convert, always in plan:
+            value = getter(entity)
+            if value is None and not always:
+                continue
+            values[name] = convert(value) if convert else value
+        return message(**values)
+
+    copy.__name__ = '%sTo%s' % (model.__name__, message.__name__)
+    return copy
+
+
+conferenceToForm = compileMapper(Conference, ConferenceForm,
+    computed={'websafeKey': _urlsafeKey})
+
+sessionToForm = compileMapper(Session, SessionForm,
+    computed={'sessionSafeKey': _urlsafeKey})
+
+profileToForm = compileMapper(Profile, ProfileForm)
+
+_summaryMappers = {}
+
+
+def conferenceSummaryMapper(projection):
+    """Return the mapper copying the projection properties of a
+    Conference into a ConferenceSummaryForm, compiled once per projection."""
+    projection = tuple(projection)
+    mapper = _summaryMappers.get(projection)
+    if mapper is None:
+        mapper = _summaryMappers[projection] = compileMapper(Conference,
+            ConferenceSummaryForm, computed={'websafeKey': _urlsafeKey},
+            fields=projection)
+    return mapper
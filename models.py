@@ -22,9 +22,16 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy lists, emptied by the Registration/WishlistEntry migration
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionKeysWishlist = ndb.StringProperty(repeated=True)
 
+class Registration(ndb.Model):
+    """Registration -- Profile child keyed by the websafe Conference key"""
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- Profile child keyed by the websafe Session key"""
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -54,6 +61,19 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # denormalized from the organizer Profile, kept in sync by a fan-out task
+    organizerDisplayName = ndb.StringProperty()
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference seat counter"""
+    seats = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class SeatAdjustment(ndb.Model):
+    """SeatAdjustment -- seats an adjust_seats task added to (or removed
+    from, when negative) its parent SeatShard"""
+    seats = ndb.IntegerProperty(indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -70,10 +90,40 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
+
+class QueryPlanForm(messages.Message):
+    """QueryPlanForm -- how queryConferences ran a query (debug)"""
+    strategy = messages.StringField(1)
+    pushedDown = messages.StringField(2, repeated=True)
+    inMemory = messages.StringField(3, repeated=True)
+    projection = messages.StringField(4, repeated=True)
+    estimates = messages.StringField(5, repeated=True)
+    scanned = messages.IntegerField(6)
+    matched = messages.IntegerField(7)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    plan = messages.MessageField(QueryPlanForm, 3)
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- Conference list entry outbound form message"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    startDate       = messages.StringField(3)
+    endDate         = messages.StringField(4)
+    organizerDisplayName = messages.StringField(5)
+    maxAttendees    = messages.IntegerField(6)
+    seatsAvailable  = messages.IntegerField(7)
+    websafeKey      = messages.StringField(8)
+
+class ConferenceSummaryForms(messages.Message):
+    """ConferenceSummaryForms -- multiple ConferenceSummaryForm outbound form message"""
+    items = messages.MessageField(ConferenceSummaryForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -93,6 +143,17 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class SessionType(messages.Enum):
+    """SessionType -- session type enumeration value"""
+    NOT_SPECIFIED = 1
+    LECTURE = 2
+    KEYNOTE = 3
+    WORKSHOP = 4
+    WORKING_SESSION = 5
+    PANEL = 6
+    DEMO = 7
+    OTHER = 8
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -102,6 +163,36 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    debug = messages.BooleanField(4)
+
+class ConferenceSearchForm(messages.Message):
+    """ConferenceSearchForm -- Conference full-text search inbound form message"""
+    query = messages.StringField(1)
+    sort = messages.StringField(2)
+    refinementTokens = messages.StringField(3, repeated=True)
+    onlyAvailable = messages.BooleanField(4)
+    pageSize = messages.IntegerField(5)
+    pageToken = messages.StringField(6)
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- one facet value and its number of matches"""
+    label = messages.StringField(1)
+    count = messages.IntegerField(2)
+    refinementToken = messages.StringField(3)
+
+class FacetForm(messages.Message):
+    """FacetForm -- facet of the search matches"""
+    name = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+class ConferenceSearchForms(messages.Message):
+    """ConferenceSearchForms -- Conference search results outbound form message"""
+    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    facets = messages.MessageField(FacetForm, 2, repeated=True)
+    totalMatches = messages.IntegerField(3)
+    nextPageToken = messages.StringField(4)
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
@@ -114,12 +205,47 @@ class Session(ndb.Model):
     highlights = ndb.StringProperty()
     speaker = ndb.StringProperty()
     duration  = ndb.IntegerProperty()
-    typeOfSession  = ndb.StringProperty()
+    typeOfSession  = ndb.StringProperty() # SessionType name
     date = ndb.DateProperty()
     startTime = ndb.TimeProperty()
+    # minutes since midnight, indexed with typeOfSession for time queries
+    startMinutes = ndb.ComputedProperty(lambda self:
+        self.startTime.hour * 60 + self.startTime.minute
+        if self.startTime else None)
     websafeConferenceKey =  ndb.StringProperty()
 
 
+class SpeakerStats(ndb.Model):
+    """SpeakerStats -- Sessions of one speaker in a Conference (parent),
+    keyed by the normalized speaker name"""
+    speaker = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.StringProperty(repeated=True, indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+    sessionCount = ndb.IntegerProperty(default=0)
+
+
+class Speaker(ndb.Model):
+    """Speaker -- index of all Sessions of a speaker, keyed by the
+    normalized speaker name"""
+    name = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.StringProperty(repeated=True, indexed=False)
+    sessionCount = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ExportJob(ndb.Model):
+    """ExportJob -- checkpoint of an NDJSON export, keyed by export id;
+    rows and chunks are counted per kind, in the order of kinds"""
+    kinds = ndb.StringProperty(repeated=True, indexed=False)
+    kindIndex = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    chunk = ndb.IntegerProperty(default=0, indexed=False)
+    rows = ndb.IntegerProperty(repeated=True, indexed=False)
+    chunks = ndb.IntegerProperty(repeated=True, indexed=False)
+    status = ndb.StringProperty(default='running')
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name  = messages.StringField(1)
@@ -135,3 +261,47 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
+
+class WishlistModifyForm(messages.Message):
+    """WishlistModifyForm -- inbound websafe Session keys to add/remove"""
+    add = messages.StringField(1, repeated=True)
+    remove = messages.StringField(2, repeated=True)
+
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- Speaker outbound form message"""
+    name = messages.StringField(1)
+    sessionCount = messages.IntegerField(2)
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple Speaker outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class WebsafeKeysForm(messages.Message):
+    """WebsafeKeysForm -- inbound list of websafe keys for batch gets"""
+    websafeKeys = messages.StringField(1, repeated=True)
+
+class ConferenceBatchItemForm(messages.Message):
+    """ConferenceBatchItemForm -- one batch get result, found is False
+    when no Conference exists for websafeKey"""
+    websafeKey = messages.StringField(1)
+    found = messages.BooleanField(2)
+    conference = messages.MessageField(ConferenceForm, 3)
+
+class ConferenceBatchForms(messages.Message):
+    """ConferenceBatchForms -- batch get results in request order"""
+    items = messages.MessageField(ConferenceBatchItemForm, 1, repeated=True)
+
+class SessionBatchItemForm(messages.Message):
+    """SessionBatchItemForm -- one batch get result, found is False
+    when no Session exists for websafeKey"""
+    websafeKey = messages.StringField(1)
+    found = messages.BooleanField(2)
+    session = messages.MessageField(SessionForm, 3)
+
+class SessionBatchForms(messages.Message):
+    """SessionBatchForms -- batch get results in request order"""
+    items = messages.MessageField(SessionBatchItemForm, 1, repeated=True)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""notifications.py
+
+Conference Organization batched confirmation emails
+
+createConference adds a PULL task holding only the websafe Conference key
+to the EMAIL_QUEUE pull queue, plus a named push task, one per
+KICK_INTERVAL, that runs the worker shortly after. The worker (also run by
+a cron job) leases the notifications in batches of BATCH_SIZE, loads the
+conferences and their organizers with one get_multi each, renders them
+with the email template (read once per instance) and sends them.
+
+A notification that fails is leased again after an exponential backoff;
+after MAX_ATTEMPTS leases it is moved to DEAD_LETTER_QUEUE, where it can be
+inspected and moved back with requeueDeadLetters().
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import logging
+import os
+import string
+import threading
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+EMAIL_QUEUE = 'confirmation-email'
+DEAD_LETTER_QUEUE = 'confirmation-email-dead'
+WORKER_URL = '/tasks/send_confirmation_emails'
+KICK_INTERVAL = 30
+BATCH_SIZE = 100
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 5
+MIN_BACKOFF = 30
+MAX_BACKOFF = 3600
+WORKER_DEADLINE = 480
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__),
+                             'templates', 'confirmation_email.txt')
+SUBJECT = 'You created a new Conference!'
+
+_template = []
+_templateLock = threading.Lock()
+
+
+@ndb.tasklet
+def enqueueConfirmationAsync(conf_key):
+    """Tasklet queueing the confirmation email of a new Conference and
+    making sure the worker runs within KICK_INTERVAL seconds."""
+    yield taskqueue.Queue(EMAIL_QUEUE).add_async(
+        taskqueue.Task(payload=conf_key.urlsafe(), method='PULL'))
+    # one worker run per interval sends all the emails queued meanwhile
+    bucket = int(time.time() // KICK_INTERVAL)
+    try:
+        yield taskqueue.Queue().add_async(taskqueue.Task(
+            name='send-confirmation-emails-%d' % bucket,
+            url=WORKER_URL, countdown=KICK_INTERVAL))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def _getTemplate():
+    """Return the email body template, read once per instance."""
+    if not _template:
+        with _templateLock:
+            if not _template:
+                with open(TEMPLATE_PATH) as f:
+                    _template.append(string.Template(f.read()))
+    return _template[0]
+
+
+def _render(conf, organizer):
+    """Return the email body confirming the creation of conf."""
+    return _getTemplate().safe_substitute(
+        organizer=(organizer.displayName if organizer else None) or
+            conf.organizerDisplayName or '',
+        name=conf.name,
+        description=conf.description or '',
+        topics=', '.join(conf.topics),
+        city=conf.city or '',
+        startDate=conf.startDate or '',
+        endDate=conf.endDate or '',
+        maxAttendees=conf.maxAttendees or 0,
+        websafeKey=conf.key.urlsafe(),
+    )
+
+
+def _backoff(task):
+    """Seconds before a failed notification is leased again."""
+    return min(MIN_BACKOFF * 2 ** task.retry_count, MAX_BACKOFF)
+
+
+def _deadLetter(queue, tasks):
+    """Move tasks to the dead letter queue."""
+    if not tasks:
+        return
+    logging.error('Giving up on %d confirmation emails: %s', len(tasks),
+                  ', '.join(task.payload for task in tasks))
+    taskqueue.Queue(DEAD_LETTER_QUEUE).add(
+        [taskqueue.Task(payload=task.payload, method='PULL') for task in tasks])
+    queue.delete_tasks(tasks)
+
+
+def sendBatch(queue=None):
+    """Lease one batch of notifications and send their emails; returns
+    the counts of tasks leased, emails sent, retried and dead lettered."""
+    queue = queue or taskqueue.Queue(EMAIL_QUEUE)
+    tasks = queue.lease_tasks(LEASE_SECONDS, BATCH_SIZE)
+    counts = {'leased': len(tasks), 'sent': 0, 'retried': 0, 'dead': 0}
+    if not tasks:
+        return counts
+
+    dead, valid, keys = [], [], []
+    for task in tasks:
+        if task.retry_count >= MAX_ATTEMPTS:
+            dead.append(task)
+            continue
+        try:
+            keys.append(ndb.Key(urlsafe=task.payload))
+        except Exception:
+            logging.error('Bad confirmation email payload: %r', task.payload)
+            dead.append(task)
+            continue
+        valid.append(task)
+
+    # one get_multi for the conferences, one for their organizers
+    confs = ndb.get_multi(keys)
+    organizers = ndb.get_multi([key.parent() for key in keys])
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+    done, failed = [], []
+    for task, conf, organizer in zip(valid, confs, organizers):
+        if not conf:
+            # deleted meanwhile, nothing to confirm
+            done.append(task)
+            continue
+        to = (organizer.mainEmail if organizer else None) or \
+            conf.key.parent().id()
+        try:
+            mail.send_mail(sender, to, SUBJECT, _render(conf, organizer))
+        except Exception:
+            logging.exception('Could not send confirmation email for %s',
+                              task.payload)
+            failed.append(task)
+            continue
+        done.append(task)
+        counts['sent'] += 1
+
+    if done:
+        queue.delete_tasks(done)
+    for task in failed:
+        queue.modify_task_lease(task, _backoff(task))
+    counts['retried'] = len(failed)
+    _deadLetter(queue, dead)
+    counts['dead'] = len(dead)
+    return counts
+
+
+def sendConfirmationEmails(deadline=WORKER_DEADLINE):
+    """Send batches until the queue is drained or deadline seconds have
+    passed; returns the summed counts of sendBatch."""
+    queue = taskqueue.Queue(EMAIL_QUEUE)
+    stop = time.time() + deadline
+    totals = {'leased': 0, 'sent': 0, 'retried': 0, 'dead': 0}
+    while time.time() < stop:
+        counts = sendBatch(queue)
+        for name, value in counts.items():
+            totals[name] += value
+        if counts['leased'] < BATCH_SIZE:
+            break
+    return totals
+
+
+def requeueDeadLetters():
+    """Move the dead lettered notifications back to EMAIL_QUEUE for a
+    new series of attempts; returns the number moved."""
+    dead_queue = taskqueue.Queue(DEAD_LETTER_QUEUE)
+    moved = 0
+    while True:
+        tasks = dead_queue.lease_tasks(LEASE_SECONDS, BATCH_SIZE)
+        if not tasks:
+            return moved
+        taskqueue.Queue(EMAIL_QUEUE).add(
+            [taskqueue.Task(payload=task.payload, method='PULL') for task in tasks])
+        dead_queue.delete_tasks(tasks)
+        moved += len(tasks)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""searchindex.py
+
+Conference Organization full-text search of conferences
+
+Every Conference has a document in the INDEX_NAME Search API index,
+keyed by its websafe key: name, description and organizer are full-text
+fields, topics and city atoms, dates and seats numbers/dates for
+filtering and sorting, and city, topic and month are facets. Documents
+are written when a conference is created, by a transactional task when
+it is updated, when the seat reconciliation changes its seats and by
+the /tasks/backfill_search_index backfill.
+
+"""
+
+__author__ = 'd.nastri@gmail.com (Davide Nastri)'
+
+import re
+from datetime import date
+
+from google.appengine.api import search
+from google.appengine.ext import ndb
+
+from models import Conference
+
+INDEX_NAME = 'conferences'
+INDEX_BATCH_SIZE = 200 # at most 200 documents per put
+FACETS = ('city', 'topic', 'month')
+FACET_VALUES = 10
+MIN_DATE = date(1970, 1, 1)
+MAX_DATE = date(9999, 12, 31)
+
+# sort name -> SortExpression, relevance sorts on the match score
+SORTS = {
+    'relevance': search.SortExpression(expression='_score',
+        direction=search.SortExpression.DESCENDING, default_value=0),
+    'startDate': search.SortExpression(expression='startDate',
+        direction=search.SortExpression.ASCENDING, default_value=MAX_DATE),
+    '-startDate': search.SortExpression(expression='startDate',
+        direction=search.SortExpression.DESCENDING, default_value=MIN_DATE),
+    'name': search.SortExpression(expression='sortName',
+        direction=search.SortExpression.ASCENDING, default_value=''),
+    'seatsAvailable': search.SortExpression(expression='seatsAvailable',
+        direction=search.SortExpression.DESCENDING, default_value=0),
+}
+
+
+def _index():
+    return search.Index(name=INDEX_NAME)
+
+
+def conferenceDocument(conf):
+    """Return the search Document of a Conference."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        # atoms sort on the whole name, text fields on its first words
+        search.AtomField(name='sortName', value=(conf.name or '').lower()[:500]),
+        search.TextField(name='description', value=conf.description or ''),
+        search.TextField(name='organizer', value=conf.organizerDisplayName or ''),
+        search.AtomField(name='city', value=conf.city or ''),
+        search.NumberField(name='month', value=conf.month or 0),
+        search.NumberField(name='maxAttendees', value=conf.maxAttendees or 0),
+        search.NumberField(name='seatsAvailable', value=conf.seatsAvailable or 0),
+    ]
+    fields += [search.AtomField(name='topic', value=topic)
+               for topic in conf.topics]
+    # dates are optional, an absent field sorts on its default value
+    if conf.startDate:
+        fields.append(search.DateField(name='startDate', value=conf.startDate))
+    if conf.endDate:
+        fields.append(search.DateField(name='endDate', value=conf.endDate))
+
+    facets = [search.AtomFacet(name='topic', value=topic) for topic in conf.topics]
+    if conf.city:
+        facets.append(search.AtomFacet(name='city', value=conf.city))
+    if conf.month:
+        facets.append(search.NumberFacet(name='month', value=conf.month))
+    return search.Document(doc_id=conf.key.urlsafe(), fields=fields,
+                           facets=facets)
+
+
+def indexConferencesAsync(confs):
+    """Start writing the documents of confs; returns the future of the
+    put, or None when there is nothing to write."""
+    if not confs:
+        return None
+    return _index().put_async([conferenceDocument(conf) for conf in confs])
+
+
+def indexConferences(confs):
+    """Write the documents of confs, INDEX_BATCH_SIZE at a time."""
+    for start in range(0, len(confs), INDEX_BATCH_SIZE):
+        _index().put([conferenceDocument(conf)
+                      for conf in confs[start:start + INDEX_BATCH_SIZE]])
+
+
+def indexConference(websafeConferenceKey):
+    """(Re)write the document of one Conference from the datastore,
+    deleting it if the Conference is gone; used by the index task."""
+    conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+    if conf:
+        indexConferences([conf])
+    else:
+        _index().delete([websafeConferenceKey])
+
+
+def backfill(cursor=None):
+    """Index one batch of existing Conferences; returns the cursor of the
+    next batch or None when done."""
+    confs, next_cursor, more = Conference.query().fetch_page(
+        INDEX_BATCH_SIZE, start_cursor=cursor)
+    indexConferences(confs)
+    return next_cursor if more else None
+
+
+def queryString(text):
+    """Turn free text into a query string matching documents holding
+    all its words, so search operators typed by users are ignored."""
+    words = re.findall(r'\w+', text or '', re.UNICODE)
+    return ' '.join('"%s"' % word for word in words)
+
+
+def searchConferences(text='', sort='relevance', refinements=(), page_size=20,
+                      cursor=None, only_available=False):
+    """Search conferences; returns the search.SearchResults holding only
+    document ids (websafe keys), the facets of the matches and the
+    cursor of the next page.
+
+    refinements are facet refinement tokens returned by an earlier search.
+    Raises ValueError for an unknown sort or a bad refinement token and
+    search.InvalidRequest for a bad cursor.
+    """
+    if sort not in SORTS:
+        raise ValueError('Unknown sort: %s' % sort)
+    query = queryString(text)
+    if only_available:
+        query = ('%s seatsAvailable > 0' % query).strip()
+
+    options = search.QueryOptions(
+        limit=page_size,
+        cursor=search.Cursor(web_safe_string=cursor) if cursor else search.Cursor(),
+        ids_only=True,
+        sort_options=search.SortOptions(
+            expressions=[SORTS[sort]],
+            match_scorer=search.MatchScorer() if sort == 'relevance' else None))
+    return _index().search(search.Query(
+        query_string=query,
+        options=options,
+        return_facets=[search.FacetRequest(name, value_limit=FACET_VALUES)
+                       for name in FACETS],
+        facet_refinements=[search.FacetRefinement.FromTokenString(token)
+                           for token in refinements]))
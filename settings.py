@@ -9,3 +9,7 @@ Udacity conference server-side Python App Engine app user settings
 # Console or Cloud Console.
 WEB_CLIENT_ID = '727907205051-573gc5ahpho4tq7tloct49fpttktkkg8.apps.googleusercontent.com'
 
+# Sampled request profiler: fraction of endpoint calls run under cProfile
+# (0 disables it) and the latency above which their stats are kept.
+PROFILE_SAMPLE_RATE = 0
+PROFILE_SLOW_MS = 1000
@@ -84,7 +84,7 @@ app.constant('HTTP_ERRORS', {
  * Service that holds the OAuth2 information shared across all the pages.
  *
  */
-app.factory('oauth2Provider', function ($modal) {
+app.factory('oauth2Provider', function ($modal, conferenceStore) {
     var oauth2Provider = {
         CLIENT_ID: '727907205051-573gc5ahpho4tq7tloct49fpttktkkg8.apps.googleusercontent.com',
         SCOPES: 'email profile',
@@ -101,7 +101,11 @@ app.factory('oauth2Provider', function ($modal) {
             'accesstype': 'online',
             'approveprompt': 'auto',
             'scope': oauth2Provider.SCOPES,
-            'callback': callback
+            'callback': function (authResult) {
+                // The cached responses may belong to another user.
+                conferenceStore.clear();
+                callback(authResult);
+            }
         });
     };
 
@@ -113,6 +117,7 @@ app.factory('oauth2Provider', function ($modal) {
         // Explicitly set the invalid access token in order to make the API calls fail.
         gapi.auth.setToken({access_token: ''})
         oauth2Provider.signedIn = false;
+        conferenceStore.clear();
     };
 
     /**
@@ -130,3 +135,182 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name conferenceStore
+ *
+ * @description
+ * Shared client-side store in front of the conference API, used by all the controllers.
+ * Responses of the read methods listed in TTLS are cached for their TTL (in ms), keyed by the
+ * method and its request parameters; duplicate calls made while one is in flight share its
+ * response. Once an entry with an etag expires, it is revalidated with ifNoneMatch and kept
+ * when the server answers notModified. A successful mutation drops the cached responses of
+ * the methods listed for it in INVALIDATES.
+ *
+ * Callbacks are always invoked asynchronously, outside of the digest cycle, as gapi does,
+ * with a copy of the response the caller may modify.
+ */
+app.factory('conferenceStore', function ($timeout) {
+    var conferenceStore = {
+        TTLS: {
+            queryConferenceSummaries: 60 * 1000,
+            getConferencesCreated: 60 * 1000,
+            getConferencesToAttend: 60 * 1000,
+            getConference: 30 * 1000,
+            getConferenceSessions: 30 * 1000,
+            getProfile: 5 * 60 * 1000
+        },
+        INVALIDATES: {
+            registerForConference: ['getProfile', 'getConference', 'getConferencesToAttend',
+                'queryConferenceSummaries', 'getConferencesCreated'],
+            unregisterFromConference: ['getProfile', 'getConference', 'getConferencesToAttend',
+                'queryConferenceSummaries', 'getConferencesCreated'],
+            saveProfile: ['getProfile', 'getConference', 'getConferencesToAttend',
+                'queryConferenceSummaries', 'getConferencesCreated'],
+            createConference: ['queryConferenceSummaries', 'getConferencesCreated']
+        }
+    };
+
+    /**
+     * Cached responses, by cache key: {response: {}, expires: number}.
+     */
+    var entries = {};
+
+    /**
+     * Callbacks waiting for the response of a call in flight, by cache key.
+     */
+    var inFlight = {};
+
+    /**
+     * Bumped by invalidate, so that the responses of calls started before are not cached.
+     */
+    var generations = {};
+
+    var cacheKey = function (method, params) {
+        return method + ':' + angular.toJson(params || {});
+    };
+
+    var deliver = function (callback, resp) {
+        if (callback) {
+            var copy = angular.copy(resp);
+            setTimeout(function () {
+                callback(copy);
+            }, 0);
+        }
+    };
+
+    /**
+     * Calls method with params through the cache.
+     *
+     * @param method the name of a gapi.client.conference method.
+     * @param params the request parameters.
+     * @param callback invoked with the response, like the callback of execute.
+     */
+    conferenceStore.execute = function (method, params, callback) {
+        var ttl = conferenceStore.TTLS[method];
+        if (!ttl) {
+            gapi.client.conference[method](params || {}).execute(callback);
+            return;
+        }
+        var key = cacheKey(method, params);
+        var entry = entries[key];
+        if (entry && entry.expires > Date.now()) {
+            deliver(callback, entry.response);
+            return;
+        }
+        if (inFlight[key]) {
+            inFlight[key].push(callback);
+            return;
+        }
+        inFlight[key] = [callback];
+
+        var request = angular.extend({}, params);
+        if (entry && entry.response.etag) {
+            request.ifNoneMatch = entry.response.etag;
+        }
+        var generation = generations[method] || 0;
+        gapi.client.conference[method](request).execute(function (resp) {
+            var callbacks = inFlight[key];
+            delete inFlight[key];
+            if (!resp.error) {
+                if (resp.notModified && entry) {
+                    resp = entry.response;
+                }
+                if ((generations[method] || 0) == generation) {
+                    entries[key] = {response: resp, expires: Date.now() + ttl};
+                }
+            }
+            angular.forEach(callbacks, function (waiting) {
+                deliver(waiting, resp);
+            });
+        });
+    };
+
+    /**
+     * Loads the response of method with params into the cache, e.g. the next page of a list.
+     */
+    conferenceStore.prefetch = function (method, params) {
+        conferenceStore.execute(method, params);
+    };
+
+    /**
+     * Calls a mutating method, dropping the cached responses it makes stale once it succeeds.
+     *
+     * @param method the name of a gapi.client.conference method.
+     * @param params the request parameters.
+     * @param callback invoked with the response, like the callback of execute.
+     */
+    conferenceStore.mutate = function (method, params, callback) {
+        gapi.client.conference[method](params || {}).execute(function (resp) {
+            if (!resp.error) {
+                conferenceStore.invalidate(conferenceStore.INVALIDATES[method] || []);
+            }
+            callback(resp);
+        });
+    };
+
+    /**
+     * Drops the cached responses of the given methods.
+     *
+     * @param methods {Array} method names.
+     */
+    conferenceStore.invalidate = function (methods) {
+        angular.forEach(methods, function (method) {
+            generations[method] = (generations[method] || 0) + 1;
+            angular.forEach(Object.keys(entries), function (key) {
+                if (key.indexOf(method + ':') === 0) {
+                    delete entries[key];
+                }
+            });
+        });
+    };
+
+    /**
+     * Drops all the cached responses, e.g. when the signed in user changes.
+     */
+    conferenceStore.clear = function () {
+        conferenceStore.invalidate(Object.keys(conferenceStore.TTLS));
+    };
+
+    /**
+     * Returns a function calling fn once no call has been made to it for wait ms.
+     *
+     * @param fn the function to debounce.
+     * @param wait the delay in ms.
+     * @returns {Function}
+     */
+    conferenceStore.debounce = function (fn, wait) {
+        var timer;
+        return function () {
+            var args = arguments;
+            $timeout.cancel(timer);
+            timer = $timeout(function () {
+                fn.apply(null, args);
+            }, wait);
+        };
+    };
+
+    return conferenceStore;
+});
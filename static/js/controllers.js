@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceStore, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,8 +63,8 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
+                conferenceStore.execute('getProfile', {},
+                    function (resp) {
                         $scope.$apply(function () {
                             $scope.loading = false;
                             if (resp.error) {
@@ -94,8 +94,8 @@ conferenceApp.controllers.controller('MyProfileCtrl',
         $scope.saveProfile = function () {
             $scope.submitted = true;
             $scope.loading = true;
-            gapi.client.conference.saveProfile($scope.profile).
-                execute(function (resp) {
+            conferenceStore.mutate('saveProfile', $scope.profile,
+                function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
                         if (resp.error) {
@@ -135,7 +135,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
  * A controller used for the Create conferences page.
  */
 conferenceApp.controllers.controller('CreateConferenceCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceStore, HTTP_ERRORS) {
 
         /**
          * The conference object being edited in the page.
@@ -214,8 +214,8 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
             }
 
             $scope.loading = true;
-            gapi.client.conference.createConference($scope.conference).
-                execute(function (resp) {
+            conferenceStore.mutate('createConference', $scope.conference,
+                function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
                         if (resp.error) {
@@ -249,7 +249,8 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl',
+    function ($scope, $log, oauth2Provider, conferenceStore, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -395,8 +396,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.clearFilters = function () {
         $scope.filters = [];
+        $scope.filtersChanged();
     };
 
+    /**
+     * Refreshes the list of all conferences once the filters have not been edited for 500 ms.
+     */
+    $scope.filtersChanged = conferenceStore.debounce(function () {
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll();
+        }
+    }, 500);
+
     /**
      * Removes the filter specified by the index from $scope.filters.
      *
@@ -405,6 +416,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     $scope.removeFilter = function (index) {
         if ($scope.filters[index]) {
             $scope.filters.splice(index, 1);
+            $scope.filtersChanged();
         }
     };
 
@@ -424,12 +436,33 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Fetches the next page of the list currently shown, using the nextPageToken
+     * returned by the previous call.
+     */
+    $scope.loadMoreConferences = function () {
+        if (!$scope.nextPageToken) {
+            return;
+        }
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll($scope.nextPageToken);
+        } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
+            $scope.getConferencesCreated($scope.nextPageToken);
+        }
+    };
+
+    /**
+     * Invokes the conference.queryConferenceSummaries API, which returns
+     * only the fields shown in the list.
+     *
+     * @param pageToken the token of the page to append, or undefined to start over.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (pageToken) {
         var sendFilters = {
             filters: []
         }
+        if (pageToken) {
+            sendFilters.pageToken = pageToken;
+        }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
             if (filter.field && filter.operator && filter.value) {
@@ -441,8 +474,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
+        conferenceStore.execute('queryConferenceSummaries', sendFilters,
+            function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -458,10 +491,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!pageToken) {
+                            $scope.conferences = [];
+                        }
+                        $scope.nextPageToken = resp.nextPageToken;
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        if (resp.nextPageToken) {
+                            // The next page is then loaded from the cache.
+                            conferenceStore.prefetch('queryConferenceSummaries',
+                                angular.extend({}, sendFilters, {pageToken: resp.nextPageToken}));
+                        }
                     }
                     $scope.submitted = true;
                 });
@@ -470,11 +511,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.getConferencesCreated method.
+     *
+     * @param pageToken the token of the page to append, or undefined to start over.
      */
-    $scope.getConferencesCreated = function () {
+    $scope.getConferencesCreated = function (pageToken) {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
-            execute(function (resp) {
+        conferenceStore.execute('getConferencesCreated', pageToken ? {pageToken: pageToken} : {},
+            function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -495,10 +538,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!pageToken) {
+                            $scope.conferences = [];
+                        }
+                        $scope.nextPageToken = resp.nextPageToken;
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        if (resp.nextPageToken) {
+                            conferenceStore.prefetch('getConferencesCreated', {pageToken: resp.nextPageToken});
+                        }
                     }
                     $scope.submitted = true;
                 });
@@ -511,8 +560,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
-            execute(function (resp) {
+        conferenceStore.execute('getConferencesToAttend', {},
+            function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
                         // The request has failed.
@@ -528,6 +577,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                     } else {
                         // The request has succeeded.
                         $scope.conferences = resp.result.items;
+                        $scope.nextPageToken = undefined;
                         $scope.loading = false;
                         $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
                         $scope.alertStatus = 'success';
@@ -547,7 +597,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl',
+    function ($scope, $log, $routeParams, oauth2Provider, conferenceStore, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -559,9 +610,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conferenceStore.execute('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -581,7 +632,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        conferenceStore.execute('getProfile', {}, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -607,9 +658,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.registerForConference = function () {
         $scope.loading = true;
-        gapi.client.conference.registerForConference({
+        conferenceStore.mutate('registerForConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -644,9 +695,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.unregisterFromConference = function () {
         $scope.loading = true;
-        gapi.client.conference.unregisterFromConference({
+        conferenceStore.mutate('unregisterFromConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -4,8 +4,29 @@ import time
 import uuid
 
 from google.appengine.api import urlfetch
+import instrumentation
 from models import Profile
+from models import SessionType
 
+def normalizeSpeaker(speaker):
+    """Return the speaker name in the form used as key, so different
+    spellings of case and spacing match."""
+    return ' '.join(speaker.split()).lower()
+
+
+def normalizeSessionType(typeOfSession):
+    """Return the SessionType name for a free text session type;
+    unknown types become OTHER."""
+    if not typeOfSession or not typeOfSession.strip():
+        return str(SessionType.NOT_SPECIFIED)
+    try:
+        return str(SessionType.lookup_by_name(
+            '_'.join(typeOfSession.upper().split())))
+    except KeyError:
+        return str(SessionType.OTHER)
+
+
+@instrumentation.timed('auth')
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()